@@ -0,0 +1,130 @@
+import argparse
+import itertools
+import json
+import platform
+import time
+from math import sqrt
+from statistics import median
+
+import numpy as np
+
+from metrics import QUIET
+from model_process import ProcessModel
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def benchmark_case(engine, n_cells, density, density_radius, n_steps, render=False, seed=100, n_workers=1,
+                   worker_backend="processes"):
+    """ Time initialisation, step, add_new_cells, delete_dead_cells (and optionally rendering) of one model.
+
+    The torus is sized so n_cells, split evenly over the three types, start at density cells per unit area.
+    """
+
+    side = sqrt(n_cells / density)
+    initial_densities = [n_cells // 3, n_cells // 3, n_cells - 2 * (n_cells // 3)]
+    radius = (density_radius, density_radius, density_radius)
+
+    init_s, model = timed(ProcessModel, initial_densities, side, side, density_radius=radius, engine=engine,
+                          seed=seed, verbosity=QUIET, n_workers=n_workers,
+                          worker_backend=worker_backend)
+
+    step_s, add_s, delete_s, stepped_cells = [], [], [], []
+    for _ in range(n_steps):
+        n = sum(model.get_density())
+        if n == 0:
+            break
+        stepped_cells.append(n)
+        step_s.append(timed(model.step)[0])
+        add_s.append(timed(model.add_new_cells)[0])
+        delete_s.append(timed(model.delete_dead_cells)[0])
+
+    result = {
+        "engine": engine,
+        "workers": n_workers,
+        "backend": worker_backend,
+        "cells": n_cells,
+        "density": density,
+        "density_radius": density_radius,
+        "width": side,
+        "height": side,
+        "steps": len(step_s),
+        "init_s": init_s,
+        "step_s": step_s,
+        "add_new_cells_s": add_s,
+        "delete_dead_cells_s": delete_s,
+        "final_cells": sum(model.get_density()),
+    }
+    if step_s:
+        total_s = [s + a + d for s, a, d in zip(step_s, add_s, delete_s)]
+        result["step_median_s"] = median(step_s)
+        result["cell_updates_per_s"] = sum(stepped_cells) / sum(step_s)
+        result["cell_updates_per_s_with_commit"] = sum(stepped_cells) / sum(total_s)
+
+    if render:
+        from rendering import ScatterFigure, snapshot
+
+        figure = ScatterFigure(side, side, initial_densities)
+        frame = snapshot(0, model)
+        result["render_s"] = timed(lambda: (figure.draw(frame), figure.to_rgb()))[0]
+
+    model.close()
+    return result
+
+
+def run_benchmarks(engines, sizes, densities, radii, n_steps, max_agent_cells, render=False, workers=(1,),
+                   backends=("processes",)):
+    results = []
+    for engine in engines:
+        for n_cells in sizes:
+            if engine == "agents" and n_cells > max_agent_cells:
+                continue
+            for density in densities:
+                for density_radius in radii:
+                    for n_workers, backend in itertools.product(workers, backends):
+                        if n_workers == 1 and backend != backends[0]:
+                            continue
+                        result = benchmark_case(engine, n_cells, density, density_radius, n_steps, render,
+                                                n_workers=n_workers, worker_backend=backend)
+                        print("{engine:>6} {cells:>8} cells  density {density:<5} radius {density_radius:<4} "
+                              "{workers:>3} {backend:<9} init {init_s:.3f}s  {rate:.0f} cell updates/s".format(
+                                  rate=result.get("cell_updates_per_s", 0), **result))
+                        results.append(result)
+    return results
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Time ProcessModel initialisation and steps over a ladder of sizes.")
+    parser.add_argument("--engines", nargs="+", default=["arrays", "agents"], choices=["arrays", "agents"])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000, 1000000])
+    parser.add_argument("--densities", type=float, nargs="+", default=[0.12, 0.5],
+                        help="initial cells per unit area; 0.12 is the default 300 cells on a 50 x 50 torus")
+    parser.add_argument("--radii", type=float, nargs="+", default=[1.0, 2.0])
+    parser.add_argument("--steps", type=int, default=5)
+    parser.add_argument("--max-agent-cells", type=int, default=10000,
+                        help="skip the mesa agent engine above this many cells")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1],
+                        help="ProcessModel n_workers values to compare, e.g. 1 8 32")
+    parser.add_argument("--backends", nargs="+", default=["processes"], choices=["processes", "threads"],
+                        help="worker backends to compare")
+    parser.add_argument("--render", action="store_true", help="also time drawing one frame")
+    parser.add_argument("--output", default="benchmark.json")
+    args = parser.parse_args()
+
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": run_benchmarks(args.engines, args.sizes, args.densities, args.radii, args.steps,
+                                  args.max_agent_cells, args.render, args.workers,
+                                  args.backends),
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
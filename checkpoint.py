@@ -0,0 +1,168 @@
+import json
+import os
+
+import numpy as np
+
+from model_arrays import CELL_DTYPE, param_value
+from model_cells import CellAgent
+from model_process import ProcessModel
+
+
+FORMAT_VERSION = 1
+
+# CELL_DTYPE plus the per-agent fields that only the agent engine keeps
+CHECKPOINT_DTYPE = np.dtype(CELL_DTYPE.descr + [("age", np.int64)])
+
+PARAMETERS = ("density_radius", "frequency_radius", "dispersal_radius", "max_cells_per_unit", "deterministic_death",
+              "age_limit", "death_ratio", "death_period_limit", "birth_rates", "k", "l", "a", "scheduler", "tau")
+
+
+def agent_records(agents, positions=None):
+    """ Pack agents (placed at positions, or at their own pos) into CHECKPOINT_DTYPE records."""
+
+    records = np.zeros(len(agents), dtype=CHECKPOINT_DTYPE)
+    for i, agent in enumerate(agents):
+        x, y = agent.pos if positions is None else positions[i]
+        records[i] = (agent.unique_id, x, y, agent.type, agent.state, param_value(agent.gamma),
+                      param_value(agent.epsilon), param_value(agent.delta), param_value(agent.d), agent.age)
+    return records
+
+
+def record_agent(model, record):
+    agent = CellAgent(int(record["unique_id"]), model, int(record["type"]))
+    agent.state = int(record["state"])
+    agent.age = int(record["age"])
+    for name in ("gamma", "epsilon", "delta", "d"):
+        value = float(record[name])
+        setattr(agent, name, None if np.isnan(value) else value)
+    return agent
+
+
+def model_state(model):
+    """ Split the complete state of model into JSON metadata and a dict of arrays.
+
+    Covers the parameters, the cells with their per-cell parameters, the pending births and deaths, the position
+    buffers, every random generator and the counters, which is all ProcessModel.step and the commit methods read.
+    """
+
+    meta = {
+        "version": FORMAT_VERSION,
+        "engine": "agents" if model.engine is None else "arrays",
+        "initial_densities": [model.num_selfish, model.num_cooperative, model.num_tkiller],
+        "width": model.space.width,
+        "height": model.space.height,
+        "parameters": {name: getattr(model, name) for name in PARAMETERS},
+        "seed": model.streams.seed,
+        "verbosity": model.verbosity,
+        "streams": model.streams.get_state(),
+        "random": model.random.getstate(),
+        "current_id": model.current_id,
+        "schedule": [model.schedule.steps, model.schedule.time],
+        "counter": model.counter,
+        "density": model.density,
+        "density_g": model.density_g,
+        "type_counts": model.type_counts,
+        "average_birthrate": model.average_birthrate,
+        "average_deathrate": model.average_deathrate,
+    }
+
+    if model.engine is None:
+        # The schedule order decides the activation order after shuffling, so cells are kept in it
+        cells = agent_records(model.schedule.agents)
+        pending = [c for c, _ in model.cells2add]
+        births = agent_records(pending, [pos for _, pos in model.cells2add])
+        deaths = np.array([c.unique_id for c, _ in model.cells2delete], dtype=np.int64)
+    else:
+        cells = np.zeros(len(model.engine.cells), dtype=CHECKPOINT_DTYPE)
+        births = np.zeros(len(model.engine.births), dtype=CHECKPOINT_DTYPE)
+        for name in CELL_DTYPE.names:
+            cells[name] = model.engine.cells.cells[name]
+            births[name] = model.engine.births[name]
+        deaths = model.engine.deaths
+
+    arrays = {"cells": cells, "births": births, "deaths": deaths}
+    for cell_type, buffer in enumerate(model.cell_pos):
+        arrays["pos_keys_{}".format(cell_type)] = buffer.keys[:len(buffer)]
+        arrays["pos_{}".format(cell_type)] = buffer.view
+    return meta, arrays
+
+
+def restore_model(meta, arrays, verbosity=None, profile=False, n_workers=1, worker_backend="processes"):
+    """ Rebuild the ProcessModel described by model_state; it continues exactly where the original left off."""
+
+    if meta["version"] != FORMAT_VERSION:
+        raise ValueError("Unsupported checkpoint version {}".format(meta["version"]))
+
+    parameters = {name: tuple(value) if isinstance(value, list) else value
+                  for name, value in meta["parameters"].items()}
+    model = ProcessModel([0, 0, 0], meta["width"], meta["height"], engine=meta["engine"], seed=meta["seed"],
+                         verbosity=meta["verbosity"] if verbosity is None else verbosity, profile=profile,
+                         n_workers=n_workers, worker_backend=worker_backend, **parameters)
+    model.num_selfish, model.num_cooperative, model.num_tkiller = meta["initial_densities"]
+    model.num_tumor_cells = model.num_selfish + model.num_cooperative
+    model.num_total = model.num_tumor_cells + model.num_tkiller
+
+    cells, births, deaths = arrays["cells"], arrays["births"], arrays["deaths"]
+    if model.engine is None:
+        agents = [record_agent(model, record) for record in cells]
+        for agent in agents:
+            model.schedule.add(agent)
+        model.place_agents(agents, list(zip(cells["x"].tolist(), cells["y"].tolist())))
+
+        by_id = {agent.unique_id: agent for agent in agents}
+        for record in births:
+            model.new_cell2add((record_agent(model, record), (float(record["x"]), float(record["y"]))))
+        for unique_id in deaths.tolist():
+            model.new_cell2delete(by_id[unique_id])
+    else:
+        records = np.zeros(len(cells), dtype=CELL_DTYPE)
+        pending = np.zeros(len(births), dtype=CELL_DTYPE)
+        for name in CELL_DTYPE.names:
+            records[name] = cells[name]
+            pending[name] = births[name]
+        model.engine.cells.append(records)
+        model.engine.births = pending
+        model.engine.deaths = np.asarray(deaths, dtype=np.int64)
+
+    model.clear_all_cell_pos()
+    for cell_type, buffer in enumerate(model.cell_pos):
+        xy = arrays["pos_{}".format(cell_type)]
+        buffer.add_many(arrays["pos_keys_{}".format(cell_type)], xy[0], xy[1])
+
+    model.streams.set_state(meta["streams"])
+    version, internal, gauss = meta["random"]
+    model.random.setstate((version, tuple(internal), gauss))
+    model.current_id = meta["current_id"]
+    model.schedule.steps, model.schedule.time = meta["schedule"]
+    model.counter = meta["counter"]
+    model.density = meta["density"]
+    model.density_g = meta["density_g"]
+    model.type_counts = meta["type_counts"]
+    model.average_birthrate = meta["average_birthrate"]
+    model.average_deathrate = meta["average_deathrate"]
+    model.neighbour_index_stale = True
+    return model
+
+
+def save_checkpoint(path, model, **extra):
+    """ Write model, plus any JSON-serialisable extra state (e.g. of the run loop), to a compressed .npz file.
+
+    The file is written next to path first and then moved over it, so a crash never leaves a half-written
+    checkpoint behind.
+    """
+
+    meta, arrays = model_state(model)
+    meta["extra"] = extra
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez_compressed(f, meta=np.array(json.dumps(meta)), **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path, verbosity=None, profile=False, n_workers=1, worker_backend="processes"):
+    """ Return the model saved at path and the extra state saved with it."""
+
+    with np.load(path, allow_pickle=False) as f:
+        meta = json.loads(str(f["meta"]))
+        arrays = {name: f[name] for name in f.files if name != "meta"}
+    return restore_model(meta, arrays, verbosity, profile, n_workers, worker_backend), meta["extra"]
@@ -0,0 +1,106 @@
+import numpy as np
+
+
+def per_type(value, n_types):
+    if value is None:
+        return None
+    return np.broadcast_to(np.asarray(value, dtype=np.float64), (n_types,)).copy()
+
+
+def growth_rates(before, after):
+    """ Relative change per type; a type that was absent grows by its absolute count instead."""
+
+    change = after - before
+    return np.where(before == 0, change, change / np.where(before == 0, 1, before))
+
+
+class ConvergenceMonitor:
+    """ Decides when a run has reached equilibrium from the per-type densities before and after each iteration.
+
+    A criterion is met once it has held for every type for more than patience consecutive iterations:
+    "density": the change in density is at most density_tolerance times the reference (initial) density;
+    "growth rate": the change in growth rate since the previous iteration is at most growth_tolerance;
+    "variance": once window iterations have been seen, the rolling coefficient of variation (std / mean) of
+    each density over the last window iterations is at most variance_tolerance.
+    Tolerances are a scalar or one value per type; a tolerance of None (or window=None) disables that criterion.
+    The first criterion met is kept as reason, together with the iteration it was met at.
+    """
+
+    def __init__(self, reference, density_tolerance=0.05, growth_tolerance=0.05, patience=10, window=None,
+                 variance_tolerance=0.05):
+        self.reference = np.asarray(reference, dtype=np.float64)
+        n_types = len(self.reference)
+        self.tolerances = {
+            "density": per_type(density_tolerance, n_types),
+            "growth rate": per_type(growth_tolerance, n_types),
+            "variance": per_type(variance_tolerance, n_types) if window else None,
+        }
+        self.patience = patience
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        n_types = len(self.reference)
+        self.iteration = 0
+        self.previous_growth = np.zeros(n_types)
+        self.history = np.zeros((self.window or 0, n_types))
+        self.counters = {name: np.zeros(n_types, dtype=np.int64) for name in self.tolerances}
+        self.diffs = {}
+        self.reason = None
+        self.stopped_at = None
+
+    def stable(self, before, after):
+        growth = growth_rates(before, after)
+        self.diffs = {"density": np.abs(after - before), "growth rate": np.abs(growth - self.previous_growth)}
+        self.previous_growth = growth
+        stable = {"density": self.diffs["density"] <= self.tolerances["density"] * self.reference
+                  if self.tolerances["density"] is not None else None,
+                  "growth rate": self.diffs["growth rate"] <= self.tolerances["growth rate"]
+                  if self.tolerances["growth rate"] is not None else None}
+
+        if self.window:
+            # Rolling window of the last densities, kept as a ring buffer
+            self.history[self.iteration % self.window] = after
+            if self.iteration + 1 >= self.window:
+                mean = self.history.mean(axis=0)
+                variation = np.where(mean > 0, self.history.std(axis=0) / np.where(mean > 0, mean, 1), 0.0)
+                self.diffs["variance"] = variation
+                stable["variance"] = variation <= self.tolerances["variance"]
+            else:
+                stable["variance"] = np.zeros(len(after), dtype=bool)
+        return stable
+
+    def update(self, before, after):
+        """ Feed the densities before and after one iteration; returns the reason to stop, or None."""
+
+        stable = self.stable(np.asarray(before, dtype=np.float64), np.asarray(after, dtype=np.float64))
+        self.iteration += 1
+
+        for name, tolerance in self.tolerances.items():
+            if tolerance is None:
+                continue
+            counter = self.counters[name]
+            counter[:] = np.where(stable[name], counter + 1, 0)
+            if self.reason is None and (counter > self.patience).all():
+                self.reason = name
+                self.stopped_at = self.iteration
+        return self.reason
+
+    def get_state(self):
+        return {"iteration": self.iteration, "previous_growth": self.previous_growth.tolist(),
+                "history": self.history.tolist(),
+                "counters": {name: counter.tolist() for name, counter in self.counters.items()},
+                "reason": self.reason, "stopped_at": self.stopped_at}
+
+    def set_state(self, state):
+        self.iteration = state["iteration"]
+        self.previous_growth = np.asarray(state["previous_growth"], dtype=np.float64)
+        self.history = np.asarray(state["history"], dtype=np.float64).reshape(self.history.shape)
+        self.counters = {name: np.asarray(counter, dtype=np.int64) for name, counter in state["counters"].items()}
+        self.reason = state["reason"]
+        self.stopped_at = state["stopped_at"]
+
+    def summary(self):
+        return {"diffs": {name: diff.tolist() for name, diff in self.diffs.items()},
+                "counters": {name: self.counters[name].tolist()
+                             for name, tolerance in self.tolerances.items() if tolerance is not None}}
@@ -0,0 +1,25 @@
+import numpy as np
+
+
+def wrap(values, size):
+    """ Wrap coordinates onto [0, size); np.mod can round tiny negative values up to size itself."""
+
+    values = np.mod(values, size)
+    values[values >= size] = 0.0
+    return values
+
+
+def sample_offspring_positions(rng, parent_x, parent_y, radius, width, height):
+    """ Place one offspring per parent uniformly in the disc of the given dispersal radius around it.
+
+    Uses polar sampling (distance radius * sqrt(u), uniform angle), so there are no rejection retries, and wraps
+    the positions onto the width x height torus. radius is a scalar or one value per parent.
+    """
+
+    n = len(parent_x)
+    distance = np.asarray(radius, dtype=np.float64) * np.sqrt(rng.random(n))
+    angle = rng.uniform(0, 2 * np.pi, size=n)
+
+    x = wrap(np.asarray(parent_x, dtype=np.float64) + distance * np.cos(angle), width)
+    y = wrap(np.asarray(parent_y, dtype=np.float64) + distance * np.sin(angle), height)
+    return x, y
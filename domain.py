@@ -0,0 +1,230 @@
+import multiprocessing
+
+import numpy as np
+
+from layouts import initial_cells
+from metrics import INFO, QUIET, RateReporting
+from model_arrays import CELL_DTYPE
+from model_process import ProcessModel, cooperative_fraction
+from model_random import RandomStreams
+from position_buffer import PositionBuffer
+from profiling import PhaseProfiler
+
+
+class StripModel(ProcessModel):
+    """ The array-engine model of one strip; ids are interleaved with the other strips so they stay unique."""
+
+    def __init__(self, first_id, id_stride, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.id_stride = id_stride
+        self.current_id = first_id - id_stride
+
+    def next_id(self):
+        self.current_id += self.id_stride
+        return self.current_id
+
+
+def strip_worker(connection, rank, n_strips, bounds, seed, width, height, cells, model_kwargs):
+    """ Serve the commands of a PartitionedModel for the strip bounds = (x0, x1) until told to close."""
+
+    x0, x1 = bounds
+    model = StripModel(len(cells) + 1 + rank, n_strips, [0, 0, 0], width, height, engine="arrays", seed=seed,
+                       verbosity=QUIET, **model_kwargs)
+    owned = cells[(cells["x"] >= x0) & (cells["x"] < x1)]
+    model.engine.cells.append(owned)
+    model.add_cell_positions(owned["unique_id"], owned["x"], owned["y"], owned["type"])
+    model.type_counts = np.bincount(owned["type"], minlength=3).tolist()
+
+    while True:
+        command, *args = connection.recv()
+
+        if command == "edges":
+            # Cells close enough to either boundary to be neighbours of cells in the adjacent strips
+            halo_width, = args
+            own = model.engine.cells.cells
+            near_left = own["x"] - x0 < halo_width
+            near_right = x1 - own["x"] <= halo_width
+            edge = near_left | near_right
+            connection.send((own["x"][edge], own["y"][edge], own["type"][edge], near_left[edge], near_right[edge]))
+
+        elif command == "step":
+            halo, type_counts = args
+            model.set_halo(*halo)
+            model.step(type_counts)
+            # Offspring dispersed out of the strip are handed back to be committed by the strip that owns them
+            births = model.engine.births
+            leaving = (births["x"] < x0) | (births["x"] >= x1)
+            model.engine.births = births[~leaving]
+            connection.send((births[leaving], model.average_birthrate, model.average_deathrate))
+
+        elif command == "add":
+            immigrants, = args
+            model.engine.births = np.concatenate((model.engine.births, immigrants))
+            connection.send(model.add_new_cells())
+
+        elif command == "delete":
+            connection.send(model.delete_dead_cells())
+
+        elif command == "cells":
+            connection.send(model.engine.cells.cells.copy())
+
+        elif command == "close":
+            connection.close()
+            return
+
+
+class PartitionedModel(RateReporting):
+    """ A ProcessModel domain split into n_strips vertical strips, each stepped by its own worker process.
+
+    Every step, each strip receives the halo of cells within max(density_radius) of its boundaries from the
+    adjacent strips, so its neighbour counts match those of a single model, and is given the global per-type
+    counts, so every strip uses the same density and g. Offspring dispersed across a boundary migrate to the
+    strip that owns their position before births are committed. Draws come from per-strip streams spawned from
+    seed, so a run is reproducible for a given n_strips but not identical to a single-process one. The methods
+    mirror those of ProcessModel that run(), the renderer, TrajectoryRecorder and SpatialStatistics use; the cells
+    are gathered from the strips at most once per commit for cell_positions() and cell_pos. Once closed, the model
+    cannot step any more.
+    """
+
+    def __init__(self, initial_densities, width, height, n_strips=None, seed=100, verbosity=INFO, layout="uniform",
+                 layout_options=None, profile=False, **model_kwargs):
+        self.width, self.height = width, height
+        self.profiler = PhaseProfiler(enabled=profile)
+        self.gathered = None
+        self.n_strips = n_strips or multiprocessing.cpu_count()
+        self.verbosity = verbosity
+        self.halo_width = max(model_kwargs.get("density_radius", (1, 1, 1)))
+        self.strip_width = width / self.n_strips
+        if self.n_strips > 1 and self.strip_width < self.halo_width:
+            raise ValueError("Strips of width {} are narrower than the density radius {}; use fewer strips".format(
+                self.strip_width, self.halo_width))
+
+        cells = initial_cells(RandomStreams(seed).init, initial_densities, width, height, layout,
+                              **(layout_options or {}))
+        self.type_counts = np.bincount(cells["type"], minlength=3).tolist()
+        self.reset_average_rates()
+        self.immigrants = [np.zeros(0, dtype=CELL_DTYPE) for _ in range(self.n_strips)]
+
+        seeds = [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(self.n_strips)]
+        self.starts = np.arange(self.n_strips) * self.strip_width
+        self.connections, self.workers = [], []
+        for rank in range(self.n_strips):
+            bounds = (self.starts[rank], width if rank == self.n_strips - 1 else self.starts[rank + 1])
+            parent, child = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=strip_worker, args=(
+                child, rank, self.n_strips, bounds, seeds[rank], width, height, cells, model_kwargs), daemon=True)
+            worker.start()
+            self.connections.append(parent)
+            self.workers.append(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def broadcast(self, *commands):
+        """ Send one command per strip (or the same one to all), then collect every reply."""
+
+        if len(commands) == 1:
+            commands = commands * self.n_strips
+        for connection, command in zip(self.connections, commands):
+            connection.send(command)
+        return [connection.recv() for connection in self.connections]
+
+    @property
+    def g(self):
+        return cooperative_fraction(self.type_counts)
+
+    def get_density(self):
+        return list(self.type_counts)
+
+    def halos(self):
+        edges = self.broadcast(("edges", self.halo_width))
+        halos = []
+        for rank in range(self.n_strips):
+            left, right = (rank - 1) % self.n_strips, (rank + 1) % self.n_strips
+            if self.n_strips == 1:
+                parts = []
+            elif left == right:
+                x, y, types, near_left, near_right = edges[left]
+                parts = [(x, y, types)]
+            else:
+                # The right edge of the strip on the left and the left edge of the strip on the right
+                parts = [[column[edges[left][4]] for column in edges[left][:3]],
+                         [column[edges[right][3]] for column in edges[right][:3]]]
+            halos.append([np.concatenate([part[axis] for part in parts]) if parts else np.zeros(0)
+                          for axis in range(3)])
+        return halos
+
+    def step(self):
+        self.profiler.next_step()
+        self.profiler.count("cells", sum(self.type_counts))
+        with self.profiler.phase("step"):
+            halos = self.halos()
+            results = self.broadcast(*[("step", halo, self.type_counts) for halo in halos])
+
+        self.reset_average_rates()
+        emigrants = []
+        for leaving, birthrate, deathrate in results:
+            emigrants.append(leaving)
+            for i in range(2):
+                for j in range(2):
+                    self.average_birthrate[i][j] += birthrate[i][j]
+                    self.average_deathrate[i][j] += deathrate[i][j]
+
+        emigrants = np.concatenate(emigrants)
+        owners = np.searchsorted(self.starts, emigrants["x"], side="right") - 1
+        self.immigrants = [emigrants[owners == rank] for rank in range(self.n_strips)]
+        self.log_average_rates()
+
+    def add_new_cells(self):
+        self.gathered = None
+        with self.profiler.phase("add_new_cells"):
+            added = self.broadcast(*[("add", immigrants) for immigrants in self.immigrants])
+        self.immigrants = [np.zeros(0, dtype=CELL_DTYPE) for _ in range(self.n_strips)]
+        added_types = np.sum(added, axis=0).tolist()
+        for cell_type in range(3):
+            self.type_counts[cell_type] += added_types[cell_type]
+        return added_types
+
+    def delete_dead_cells(self):
+        self.gathered = None
+        with self.profiler.phase("delete_dead_cells"):
+            dead_types = np.sum(self.broadcast(("delete",)), axis=0).tolist()
+        for cell_type in range(3):
+            self.type_counts[cell_type] -= dead_types[cell_type]
+        return dead_types
+
+    def cells(self):
+        """ Gather the cells of every strip, sorted by unique_id."""
+
+        if self.gathered is None:
+            cells = np.concatenate(self.broadcast(("cells",)))
+            self.gathered = cells[np.argsort(cells["unique_id"], kind="stable")]
+        return self.gathered
+
+    def cell_positions(self):
+        cells = self.cells()
+        return cells["x"], cells["y"], cells["type"]
+
+    @property
+    def cell_pos(self):
+        """ Per-type PositionBuffers of the gathered cells, like ProcessModel.cell_pos."""
+
+        cells = self.cells()
+        buffers = []
+        for cell_type in range(3):
+            of_type = cells[cells["type"] == cell_type]
+            buffer = PositionBuffer(max(len(of_type), 1))
+            buffer.add_many(of_type["unique_id"], of_type["x"], of_type["y"])
+            buffers.append(buffer)
+        return buffers
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(("close",))
+        for worker in self.workers:
+            worker.join()
+        self.connections, self.workers = [], []
@@ -0,0 +1,30 @@
+class EventQueue:
+    """ Pending cell events keyed by unique_id, with O(1) membership and per-type counts."""
+
+    def __init__(self):
+        self.events = {}
+        self.type_counts = [0, 0, 0]
+
+    def __len__(self):
+        return len(self.events)
+
+    def __contains__(self, cell):
+        return cell.unique_id in self.events
+
+    def __iter__(self):
+        return iter(self.events.values())
+
+    def push(self, cell, payload=None):
+        if cell.unique_id in self.events:
+            return False
+        self.events[cell.unique_id] = (cell, payload)
+        self.type_counts[cell.type] += 1
+        return True
+
+    def drain(self):
+        """ Return every pending (cell, payload) in insertion order and empty the queue."""
+
+        events = list(self.events.values())
+        self.events = {}
+        self.type_counts = [0, 0, 0]
+        return events
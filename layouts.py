@@ -0,0 +1,89 @@
+import numpy as np
+
+from dispersal import wrap
+from model_arrays import CELL_DTYPE
+
+
+# Parameters every initial cell starts with; offspring inherit those of their parent
+GAMMA = 0.1
+EPSILON = 0.7
+DELTA = 0.001
+MAX_MORTALITY_RATE = 0.2
+
+
+def uniform_layout(rng, n, width, height):
+    return rng.uniform(0, width, size=n), rng.uniform(0, height, size=n)
+
+
+def disc_layout(rng, n, width, height, radius=None):
+    """ Uniform within a disc around the centre of the torus, a quarter of its smaller side by default."""
+
+    if radius is None:
+        radius = min(width, height) / 4
+    distance = radius * np.sqrt(rng.random(n))
+    angle = rng.uniform(0, 2 * np.pi, size=n)
+    return (wrap(width / 2 + distance * np.cos(angle), width),
+            wrap(height / 2 + distance * np.sin(angle), height))
+
+
+def clustered_layout(rng, n, width, height, n_clusters=10, spread=2.0):
+    """ Normally distributed (sd spread) around n_clusters uniformly placed centres, as in a Thomas process."""
+
+    centre_x, centre_y = uniform_layout(rng, n_clusters, width, height)
+    cluster = rng.integers(n_clusters, size=n)
+    return (wrap(centre_x[cluster] + rng.normal(0, spread, size=n), width),
+            wrap(centre_y[cluster] + rng.normal(0, spread, size=n), height))
+
+
+LAYOUTS = {"uniform": uniform_layout, "disc": disc_layout, "clustered": clustered_layout}
+
+
+def read_layout(path):
+    """ Read x, y and optionally type columns from a structured .npy file or a CSV file with a header row."""
+
+    if path.endswith(".npy"):
+        table = np.load(path)
+    else:
+        table = np.genfromtxt(path, delimiter=",", names=True)
+    types = table["type"].astype(np.int8) if "type" in table.dtype.names else None
+    return np.atleast_1d(table["x"]), np.atleast_1d(table["y"]), types
+
+
+def initial_cells(rng, initial_densities, width, height, layout="uniform", **options):
+    """ All initial cells as CELL_DTYPE records with unique_ids 1..n, drawn in one vectorised pass.
+
+    initial_densities gives the number of cells per type, in shuffled order. layout is "uniform", "disc",
+    "clustered", "file" (with options path=..., see read_layout) or a function (rng, n, width, height, **options)
+    returning the x and y arrays. A layout file with a type column also sets the types, and so the counts.
+    Tumour cells get GAMMA and EPSILON, T-killer cells GAMMA and DELTA, and every type one mortality rate d drawn
+    uniformly from [0, MAX_MORTALITY_RATE).
+    """
+
+    if isinstance(layout, str) and layout != "file" and layout not in LAYOUTS:
+        raise ValueError("Unknown layout {!r}; use one of {} or a function".format(
+            layout, ", ".join(sorted(LAYOUTS) + ["file"])))
+
+    mortality_rates = rng.uniform(0, MAX_MORTALITY_RATE, size=3)
+    if layout == "file":
+        x, y, types = read_layout(**options)
+        if types is None:
+            types = rng.permutation(np.repeat(np.arange(3, dtype=np.int8), initial_densities))
+        x, y = wrap(np.asarray(x, dtype=np.float64), width), wrap(np.asarray(y, dtype=np.float64), height)
+    else:
+        types = rng.permutation(np.repeat(np.arange(3, dtype=np.int8), initial_densities))
+        x, y = LAYOUTS.get(layout, layout)(rng, len(types), width, height, **options)
+
+    if len(x) != len(types):
+        raise ValueError("The layout has {} positions for {} cells".format(len(x), len(types)))
+
+    cells = np.zeros(len(types), dtype=CELL_DTYPE)
+    cells["unique_id"] = np.arange(1, len(types) + 1)
+    cells["x"] = x
+    cells["y"] = y
+    cells["type"] = types
+    cells["state"] = 1
+    cells["gamma"] = GAMMA
+    cells["epsilon"] = np.where(types != 2, EPSILON, np.nan)
+    cells["delta"] = np.where(types == 2, DELTA, np.nan)
+    cells["d"] = mortality_rates[types]
+    return cells
@@ -1,10 +1,19 @@
 from model_process import ProcessModel
-from matplotlib import pyplot as plt
-
-import imageio
+from domain import PartitionedModel
+from trajectory import TrajectoryRecorder
+from metrics import DEBUG, INFO, QUIET, MetricsSink
+from convergence import ConvergenceMonitor, growth_rates
+from spatial_stats import SpatialStatistics
+from checkpoint import load_checkpoint, save_checkpoint
+
+import argparse
+import contextlib
+import numpy as np
 import glob
+import json
 import re
 import os
+import sys
 
 use_egtplot = False
 
@@ -25,176 +34,275 @@ def numerical_sort(value):
     return parts
 
 
-def scatter_plot(i, model, initial_densities):
-
-    selfish = plt.scatter(model.pos_selfish_cells[0], model.pos_selfish_cells[1], c='r', s=4, label='Selfish Cells')
-    cooperative = plt.scatter(model.pos_cooperative_cells[0], model.pos_cooperative_cells[1], c='b', s=4,
-                              label='Cooperative Cells')
-    tkiller = plt.scatter(model.pos_tkiller_cells[0], model.pos_tkiller_cells[1], c='g', s=4, label="T-Killer Cells")
-    plt.xlim(0, model.space.width)
-    plt.ylim(0, model.space.height)
-    plt.title("Iteration {}, Initial Density: [{}, {}, {}]".format(i, initial_densities[0],
-                                                                   initial_densities[1], initial_densities[2]))
-    if initial_densities[0] == 0:
-        plt.legend(handles=[cooperative, tkiller], loc=7)
-    elif initial_densities[1] == 0:
-        plt.legend(handles=[selfish, tkiller], loc=7)
-    else:
-        plt.legend(handles=[selfish, cooperative, tkiller], loc=7)
-
-    directory = "figures_{}_{}_{}".format(initial_densities[0], initial_densities[1], initial_densities[2])
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-
-    plt.savefig("figures_{}_{}_{}\\fig{}.jpg".format(initial_densities[0], initial_densities[1], initial_densities[2], i))
-    plt.gcf().clear()
-
-
-def files_ordered(folder):
+def files_ordered(folder, verbosity=INFO):
     ordered_files = []
-    for infile in sorted(glob.glob('{}\\*.jpg'.format(folder)), key=numerical_sort):
+    for infile in sorted(glob.glob(os.path.join(folder, '*.jpg')), key=numerical_sort):
         ordered_files.append(infile)
-    print(ordered_files)
+    if verbosity >= DEBUG:
+        print(ordered_files)
     return ordered_files
 
 
-def make_gif(initial_density):
+def make_gif(initial_density, verbosity=INFO):
+    import imageio
 
     folder = "figures_{}_{}_{}".format(initial_density[0], initial_density[1], initial_density[2])
-    with imageio.get_writer('process.gif', mode='I') as writer:
-        files = files_ordered(folder)
+    files = files_ordered(folder, verbosity)
+    with imageio.get_writer('process_{}_{}_{}.gif'.format(initial_density[0], initial_density[1], initial_density[2]),
+                            mode='I', fps=(len(files)/10)) as writer:
         for filename in files:
 
             image = imageio.imread(filename)
             writer.append_data(image)
 
-    gif = imageio.mimread('process.gif')
-
-    imageio.mimsave('process_{}_{}_{}.gif'.format(initial_density[0], initial_density[1], initial_density[2]),
-                    gif, fps=(len(files)/10))
-
-    if os.path.isfile("process.gif"):
-        try:
-            os.remove("process.gif")
-        except:
-            pass
-
-
-def run(initial_density, n_iteration=100, plot_frequency=1):
 
-    model = ProcessModel(initial_density, 50, 50)
+def run(initial_density, n_iteration=100, plot_frequency=1, engine="agents", width=50, height=50, animation=None,
+        fps=10, trajectory=None, verbosity=INFO, metrics=None, convergence=None, checkpoint=None,
+        checkpoint_every=0, resume=False, spatial_statistics=None, n_strips=None, **model_kwargs):
+
+    # With a checkpoint path the whole run state is saved there every checkpoint_every iterations; with resume the
+    # run continues from that file if it exists, exactly as if it had never been interrupted
+    # The frames before the checkpoint cannot be recovered from an animation, so it is not resumed
+    extra = None
+    if n_strips is not None:
+        # The domain is split into n_strips strips stepped by their own processes (see PartitionedModel), which
+        # always use the array engine and keep no checkpointable state in this process. The strip processes are
+        # daemonic and cannot start processes of their own, so n_workers > 1 splits each strip over threads
+        if engine != "arrays":
+            raise ValueError("n_strips needs engine=\"arrays\"")
+        if checkpoint is not None:
+            raise ValueError("A run split into strips (n_strips) cannot be checkpointed")
+        if model_kwargs.get("n_workers", 1) > 1:
+            model_kwargs["worker_backend"] = "threads"
+        model = PartitionedModel(initial_density, width, height, n_strips=n_strips, verbosity=verbosity,
+                                 **model_kwargs)
+    elif resume and checkpoint is not None and os.path.isfile(checkpoint):
+        if animation is not None and plot_frequency > 0:
+            raise ValueError("An animation cannot be resumed; draw JPEG frames (animation=None) to resume runs")
+        model, extra = load_checkpoint(checkpoint, verbosity, model_kwargs.get("profile", False),
+                                       model_kwargs.get("n_workers", 1),
+                                       model_kwargs.get("worker_backend", "processes"))
+        width, height = model.space.width, model.space.height
+    else:
+        model = ProcessModel(initial_density, width, height, engine=engine, verbosity=verbosity, **model_kwargs)
+    # metrics is a MetricsSink, or a CSV / Parquet path for a new one; without either the rows stay in memory
+    if not isinstance(metrics, MetricsSink):
+        metrics = MetricsSink(metrics)
+    if extra is not None:
+        metrics.resume(extra["iteration"])
+    renderer = None
+    if plot_frequency > 0:
+        # Plotting is only imported when frames are drawn, so headless runs never pay for matplotlib
+        from rendering import AnimationSink, FrameRenderer, JpegSink
+
+        # With an animation path the frames are streamed straight into it, otherwise saved as JPEGs for make_gif
+        if animation is not None:
+            sink = AnimationSink(animation, fps)
+        else:
+            sink = JpegSink("figures_{}_{}_{}".format(initial_density[0], initial_density[1], initial_density[2]))
+        renderer = FrameRenderer(width, height, initial_density, sink)
+    densities = [model.get_density()] if extra is None else extra["densities"]
+    start = 0 if extra is None else extra["iteration"]
+    equilibrium = None
+
+    recorder = None
+    if trajectory is not None:
+        recorder = TrajectoryRecorder(trajectory)
+        if extra is None:
+            recorder.record(0, model)
+        else:
+            recorder.resume(start, model)
+
+    # spatial_statistics is a SpatialStatistics, or a dict of its options (path, every, r_max, ...) for a new one
+    statistics = spatial_statistics
+    if statistics is not None and not isinstance(statistics, SpatialStatistics):
+        statistics = SpatialStatistics(width, height, **statistics)
+    if statistics is not None:
+        if extra is None:
+            statistics.sample(0, model)
+        else:
+            statistics.resume(start)
 
-    density_stable_counter = [0, 0, 0]
-    growth_rate_stable_counter = [0, 0, 0]
-    before_growth_rates = [0, 0, 0]
+    # convergence is a ConvergenceMonitor, a dict of its options, None for the defaults or False to never stop early
+    monitor = None
+    if isinstance(convergence, ConvergenceMonitor):
+        monitor = convergence
+    elif convergence is not False:
+        monitor = ConvergenceMonitor(initial_density, **dict({"growth_tolerance": SIGNIFICANCE_EQ_GROWTH_RATE},
+                                                             **(convergence or {})))
+    if monitor is not None and extra is not None and extra["monitor"] is not None:
+        monitor.set_state(extra["monitor"])
 
-    for i in range(n_iteration):
+    for i in range(start, n_iteration):
 
-        print("i: ", i)
+        model.log(INFO, "i: ", i)
 
-        model.clear_all_cell_pos()
-        if len(model.schedule.agents) == 0:
+        if sum(model.get_density()) == 0:
             break
 
         before_densities = model.get_density()
 
         model.step()
-        for c in model.schedule.agents:
-            model.add_cell_pos(c.pos, c.type)
 
         added_types = model.add_new_cells()
-        print("Added selfish: {}\nAdded coop: {}\nAdded tkiller: {}".format(added_types[0], added_types[1],
-                                                                            added_types[2]))
+        model.log(INFO, "Added selfish: {}\nAdded coop: {}\nAdded tkiller: {}".format(added_types[0], added_types[1],
+                                                                                       added_types[2]))
 
         dead_types = model.delete_dead_cells()
-        print("Dead selfish: {}\nDead coop: {}\nDead tkiller: {}".format(dead_types[0], dead_types[1], dead_types[2]))
+        model.log(INFO, "Dead selfish: {}\nDead coop: {}\nDead tkiller: {}".format(dead_types[0], dead_types[1],
+                                                                                    dead_types[2]))
 
-        if plot_frequency > 0 and i % plot_frequency == 0:
-            scatter_plot(i, model, initial_density)
+        if renderer is not None and i % plot_frequency == 0:
+            with model.profiler.phase("render_submit"):
+                renderer.submit(i, model)
 
         after_densities = model.get_density()
-        diff_densities = [abs(before_densities[0] - after_densities[0]), abs(before_densities[1] - after_densities[1]),
-                          abs(before_densities[2] - after_densities[2])]
-
-        def growth_rate(before, after):
-            if before == 0:
-                return after - before
-            return (after - before)/before
-
-        after_growth_rates = [growth_rate(before_densities[0], after_densities[0]),
-                        growth_rate(before_densities[1], after_densities[1]),
-                              growth_rate(before_densities[2], after_densities[2])]
-        diff_growth_rates = [abs(before_growth_rates[0] - after_growth_rates[0]),
-                                 abs(before_growth_rates[1] - after_growth_rates[1]),
-                             abs(before_growth_rates[2] - after_growth_rates[1])]
-
-        if diff_densities[0] <= (0.05 * initial_density[0]):
-            density_stable_counter[0] += 1
-        else:
-            density_stable_counter[0] = 0
-
-        if diff_densities[1] <= (0.05 * initial_density[1]):
-            density_stable_counter[1] += 1
-        else:
-            density_stable_counter[1] = 0
-
-        if diff_densities[2] <= (0.05 * initial_density[2]):
-            density_stable_counter[2] += 1
-        else:
-            density_stable_counter[2] = 0
-
-        if diff_growth_rates[0] <= 0.05:
-            growth_rate_stable_counter[0] += 1
-        else:
-            growth_rate_stable_counter[0] = 0
-
-        if diff_growth_rates[1] <= 0.05:
-            growth_rate_stable_counter[1] += 1
-        else:
-            growth_rate_stable_counter[1] = 0
-
-        if diff_growth_rates[2] <= 0.05:
-            growth_rate_stable_counter[2] += 1
-        else:
-            growth_rate_stable_counter[2] = 0
-
-        print("difference densities: {} and stability_counter: {}".format(diff_densities, density_stable_counter))
-        print("difference growth rates: {} and stability counter: {}".format(diff_growth_rates,
-                                                                             growth_rate_stable_counter))
-
-        if density_stable_counter[0] > 10 and density_stable_counter[1] > 10 and density_stable_counter[2] > 10:
-            print("EQ density")
-            break
-        if growth_rate_stable_counter[0] > 10 and growth_rate_stable_counter[1] > 10 and growth_rate_stable_counter[2] > 10:
-            print("EQ growth rate")
-            break
-
-        before_growth_rates = after_growth_rates
+        densities.append(after_densities)
+        if recorder is not None:
+            recorder.record(i + 1, model)
+        if statistics is not None:
+            statistics.sample(i + 1, model)
+
+        after_growth_rates = growth_rates(np.asarray(before_densities, dtype=float),
+                                          np.asarray(after_densities, dtype=float)).tolist()
+        average_birthrate, average_deathrate = model.average_rates()
+        metrics.record(iteration=i,
+                       births_selfish=added_types[0], births_cooperative=added_types[1], births_tkiller=added_types[2],
+                       deaths_selfish=dead_types[0], deaths_cooperative=dead_types[1], deaths_tkiller=dead_types[2],
+                       birthrate_tumour=average_birthrate[0], birthrate_tkiller=average_birthrate[1],
+                       deathrate_tumour=average_deathrate[0], deathrate_tkiller=average_deathrate[1],
+                       selfish=after_densities[0], cooperative=after_densities[1], tkiller=after_densities[2],
+                       growth_selfish=after_growth_rates[0], growth_cooperative=after_growth_rates[1],
+                       growth_tkiller=after_growth_rates[2])
+
+        if monitor is not None:
+            equilibrium = monitor.update(before_densities, after_densities)
+            model.log(INFO, "differences and stability counters: {}".format(monitor.summary()))
+            if equilibrium is not None:
+                model.log(INFO, "EQ " + equilibrium)
+                break
+
+        if checkpoint is not None and checkpoint_every > 0 and (i + 1) % checkpoint_every == 0:
+            metrics.flush()
+            if recorder is not None:
+                recorder.flush()
+            if statistics is not None:
+                statistics.save()
+            save_checkpoint(checkpoint, model, iteration=i + 1, densities=densities,
+                            monitor=None if monitor is None else monitor.get_state())
+
+    metrics.close()
+    model.close()
+    if recorder is not None:
+        recorder.close()
+    if statistics is not None:
+        statistics.save()
+    if renderer is not None:
+        renderer.close()
+        if animation is None:
+            make_gif(initial_density, verbosity)
+
+    return {"densities": densities, "equilibrium": equilibrium, "iterations": len(densities) - 1}
+
+
+def plot_simplex():
+    """ Show the replicator dynamics of the three strategies on a simplex with egtplot."""
 
-    make_gif(initial_density)
-
-
-initial_densities = [[100, 100, 100]]
-
-for id in initial_densities:
-    run(id, n_iteration=100, plot_frequency=1)
-
-
-if use_egtplot:
     from egtplot import plot_static
+    from matplotlib import pyplot as plt
 
     def get_payoff(alpha, beta, gamma, rho):
         return [[0, alpha, 0],
                 [1 + alpha - beta, 1 - 2 * beta, 1 - beta + rho],
                 [1 - gamma, 1 - gamma, 1 - gamma]]
 
-
     parameter_values = [[1], [1], [1], [1]]
     labels = ['S', 'D', 'I']
     # simplex = plot_static(parameter_values, custom_func=get_payoff, vert_labels=labels)
     # payoff_entries = [[0], [-1], [3], [-1], [0], [1], [3], [1], [0]]
     simplex = plot_static(parameter_values, custom_func=get_payoff, vert_labels=labels,
-                            paths=True, generations=10, steps=2000, ic_type='random', path_color='viridis')
+                          paths=True, generations=10, steps=2000, ic_type='random', path_color='viridis')
     plt.show(simplex)
 
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run ProcessModel simulations and write their results as JSON.")
+    parser.add_argument("--config", help="JSON file of run() arguments; the options below override it")
+    parser.add_argument("--initial-density", type=int, nargs=3, action="append", metavar=("SELFISH", "COOP", "TKILLER"),
+                        help="initial cells per type; repeat for several runs")
+    parser.add_argument("--iterations", type=int, dest="n_iteration")
+    parser.add_argument("--engine", choices=["agents", "arrays"])
+    parser.add_argument("--width", type=float)
+    parser.add_argument("--height", type=float)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--workers", type=int, dest="n_workers", help="workers for the neighbour counts and rates")
+    parser.add_argument("--worker-backend", choices=["processes", "threads"])
+    parser.add_argument("--strips", type=int, dest="n_strips",
+                        help="split the domain into this many strips stepped in parallel; needs --engine arrays, "
+                             "and --workers then splits each strip over threads")
+    parser.add_argument("--layout", choices=["uniform", "disc", "clustered", "file"],
+                        help="initial placement of the cells; give a file layout its path in the config file")
+    parser.add_argument("--plot-frequency", type=int, help="draw every n-th iteration; 0 (the default) draws nothing")
+    parser.add_argument("--animation", help="stream the frames into this video / GIF instead of JPEGs")
+    parser.add_argument("--trajectory", help="record the cells to this directory")
+    parser.add_argument("--metrics", help="write per-iteration metrics to this CSV or Parquet file")
+    parser.add_argument("--spatial-statistics", help="sample pair correlations, local g and clusters to this .npz")
+    parser.add_argument("--spatial-every", type=int, help="sample the spatial statistics every n-th iteration")
+    parser.add_argument("--checkpoint", help="save the run state to this file")
+    parser.add_argument("--checkpoint-every", type=int)
+    parser.add_argument("--resume", action="store_true", default=None, help="continue from --checkpoint if it exists")
+    parser.add_argument("--verbosity", type=int, choices=[0, 1, 2],
+                        help="progress output, on stderr when the results go to stdout; 0 (the default) prints nothing")
+    parser.add_argument("--output", default="-", help="JSON results file, - for stdout")
+    parser.add_argument("--egtplot", action="store_true", help="also show the egtplot simplex")
+    return parser.parse_args(argv)
+
+
+def run_config(args):
+    """ The run() arguments of every run asked for by parsed command-line args, config file first."""
+
+    config = {"plot_frequency": 0, "verbosity": QUIET}
+    if args.config is not None:
+        with open(args.config) as f:
+            config.update(json.load(f))
+    for name in ("n_iteration", "engine", "width", "height", "seed", "n_workers", "worker_backend", "n_strips",
+                 "layout", "plot_frequency", "animation", "trajectory", "metrics", "checkpoint", "checkpoint_every",
+                 "resume", "verbosity"):
+        if getattr(args, name) is not None:
+            config[name] = getattr(args, name)
+    if args.spatial_statistics is not None or args.spatial_every is not None:
+        config["spatial_statistics"] = dict(config.get("spatial_statistics") or {})
+        for name, value in (("path", args.spatial_statistics), ("every", args.spatial_every)):
+            if value is not None:
+                config["spatial_statistics"][name] = value
+
+    initial_densities = args.initial_density or [config.pop("initial_density", [100, 100, 100])]
+    config.pop("initial_density", None)
+    return [dict(config, initial_density=initial_density) for initial_density in initial_densities]
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = []
+    # The results go to stdout by default, so any progress output of the runs goes to stderr then
+    log_stream = sys.stderr if args.output == "-" else sys.stdout
+    with contextlib.redirect_stdout(log_stream):
+        for config in run_config(args):
+            result = run(**config)
+            result["config"] = config
+            results.append(result)
+
+    if args.output == "-":
+        json.dump(results, sys.stdout)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f)
+
+    if use_egtplot or args.egtplot:
+        plot_simplex()
+    return results
+
+
+if __name__ == "__main__":
+    main()
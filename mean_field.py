@@ -0,0 +1,118 @@
+import inspect
+
+import numpy as np
+
+from layouts import DELTA, EPSILON, GAMMA, MAX_MORTALITY_RATE
+from model_process import ProcessModel
+from model_random import RandomStreams
+
+
+def per_type(value):
+    """ A per-type parameter as an array whose last axis holds the three types."""
+
+    value = np.asarray(value, dtype=np.float64)
+    return np.broadcast_to(value, value.shape[:-1] + (3,)) if value.ndim else np.full(3, float(value))
+
+
+class MeanFieldModel:
+    """ Deterministic well-mixed approximation of ProcessModel, for batches of parameter sets.
+
+    Takes the parameters of ProcessModel (those without a mean-field meaning, like engine or layout, are ignored).
+    Every cell is assumed to see the expected number of neighbours of a uniformly mixed population, (N - self)
+    * pi * density_radius^2 / (width * height), and the birth and death probabilities of CellAgent.give_birth and
+    cell_death are evaluated at those counts. The populations then follow dN/dt = N * (p_birth - p_death) with
+    one unit of time per ProcessModel step.
+
+    Any parameter may be an array: scalars broadcast over a leading batch shape, per-type parameters take their
+    three types on the last axis. The mortality rates default to those ProcessModel draws for the same seed.
+    """
+
+    def __init__(self, initial_densities, width, height, density_radius=(1, 1, 1), frequency_radius=(1, 1, 1),
+                 birth_rates=(0.2, 0.2, 0.2), k=25, l=20, a=1, seed=100, mortality_rates=None, gamma=GAMMA,
+                 epsilon=EPSILON, delta=DELTA, **process_model_kwargs):
+        unknown = set(process_model_kwargs) - set(inspect.signature(ProcessModel).parameters)
+        if unknown:
+            raise TypeError("Unknown parameters {}".format(sorted(unknown)))
+
+        if mortality_rates is None:
+            mortality_rates = RandomStreams(seed).init.uniform(0, MAX_MORTALITY_RATE, size=3)
+
+        width = np.asarray(width, dtype=np.float64)
+        height = np.asarray(height, dtype=np.float64)
+        self.area = width * height
+        R = np.minimum(width, height) / 2.0
+
+        density_radius = per_type(density_radius)
+        frequency_radius = per_type(frequency_radius)
+        self.neighbourhood = np.pi * density_radius * density_radius
+        self.K = np.asarray(k, dtype=np.float64)[..., None] * (frequency_radius * frequency_radius) / \
+            (R * R)[..., None]
+        self.birth_rates = per_type(birth_rates)
+        self.mortality_rates = per_type(mortality_rates)
+        self.l, self.a = np.asarray(l, dtype=np.float64), np.asarray(a, dtype=np.float64)
+        self.gamma, self.epsilon, self.delta = (np.asarray(value, dtype=np.float64)
+                                                for value in (gamma, epsilon, delta))
+
+        self.densities = per_type(initial_densities)
+        self.batch_shape = np.broadcast(
+            self.densities[..., 0], self.area, self.K[..., 0], self.neighbourhood[..., 0],
+            self.birth_rates[..., 0], self.mortality_rates[..., 0], self.l, self.a, self.gamma, self.epsilon,
+            self.delta).shape
+        self.densities = np.broadcast_to(self.densities, self.batch_shape + (3,)).copy()
+
+    def rates(self, densities):
+        """ Per-capita birth and death probabilities per step of each type, each of shape batch + (3,)."""
+
+        tumour = densities[..., 0] + densities[..., 1]
+        tkiller = densities[..., 2]
+        g = np.where(tumour > 0, densities[..., 1] / np.where(tumour > 0, tumour, 1), 0.0)
+
+        # Expected neighbours of one cell of each type, leaving out the cell itself
+        scale = self.neighbourhood / self.area[..., None]
+        own_tumour = np.array([1.0, 1.0, 0.0])
+        n_tumour = np.maximum(tumour[..., None] - own_tumour, 0) * scale
+        n_tkiller = np.maximum(tkiller[..., None] - (1 - own_tumour), 0) * scale
+        sqrt_tumour = np.sqrt(n_tumour)
+
+        birth = np.empty(np.broadcast(n_tumour, self.K).shape)
+        birth[..., :2] = 1 - sqrt_tumour[..., :2] / self.K[..., :2]
+        birth[..., 2] = 1 - n_tkiller[..., 2] / (self.l + self.a * sqrt_tumour[..., 2])
+        birth = np.clip(self.birth_rates * birth, 0, 1)
+
+        death = np.empty_like(birth)
+        mu = self.gamma * (1 - g * self.epsilon)
+        crowded = n_tumour[..., :2] > 0
+        death[..., :2] = np.where(crowded, self.mortality_rates[..., :2] + mu[..., None] * n_tkiller[..., :2] /
+                                  np.where(crowded, sqrt_tumour[..., :2], 1), 0.0)
+        death[..., 2] = self.mortality_rates[..., 2] + self.delta * g * sqrt_tumour[..., 2]
+        death = np.clip(death, 0, 1)
+
+        return birth, death
+
+    def derivative(self, densities):
+        birth, death = self.rates(densities)
+        return densities * (birth - death)
+
+    def step(self, dt=1.0):
+        """ Advance every parameter set by dt steps with one classical Runge-Kutta (RK4) step."""
+
+        y = self.densities
+        k1 = self.derivative(y)
+        k2 = self.derivative(y + dt / 2 * k1)
+        k3 = self.derivative(y + dt / 2 * k2)
+        k4 = self.derivative(y + dt * k3)
+        self.densities = np.maximum(y + dt / 6 * (k1 + 2 * k2 + 2 * k3 + k4), 0)
+
+    def solve(self, n_steps, substeps=4):
+        """ Integrate n_steps ProcessModel steps, each in substeps RK4 steps.
+
+        Returns the densities after every step, of shape (n_steps + 1,) + batch + (3,).
+        """
+
+        trajectory = np.empty((n_steps + 1,) + self.densities.shape)
+        trajectory[0] = self.densities
+        for i in range(n_steps):
+            for _ in range(substeps):
+                self.step(1.0 / substeps)
+            trajectory[i + 1] = self.densities
+        return trajectory
@@ -0,0 +1,141 @@
+import csv
+import os
+
+import numpy as np
+
+
+# Verbosity levels: QUIET prints nothing, INFO one summary per iteration, DEBUG also per-cell progress
+QUIET, INFO, DEBUG = 0, 1, 2
+
+METRICS_DTYPE = np.dtype([
+    ("iteration", np.int64),
+    ("births_selfish", np.int64), ("births_cooperative", np.int64), ("births_tkiller", np.int64),
+    ("deaths_selfish", np.int64), ("deaths_cooperative", np.int64), ("deaths_tkiller", np.int64),
+    ("birthrate_tumour", np.float64), ("birthrate_tkiller", np.float64),
+    ("deathrate_tumour", np.float64), ("deathrate_tkiller", np.float64),
+    ("selfish", np.int64), ("cooperative", np.int64), ("tkiller", np.int64),
+    ("growth_selfish", np.float64), ("growth_cooperative", np.float64), ("growth_tkiller", np.float64),
+])
+
+
+class RateReporting:
+    """ Average birth and death probabilities of the last step, and logging filtered by self.verbosity.
+
+    Shared by ProcessModel and PartitionedModel; average_birthrate and average_deathrate hold [sum, count] of the
+    probabilities of the tumour cells and of the T-killer cells.
+    """
+
+    def reset_average_rates(self):
+        self.average_birthrate = [[0, 0], [0, 0]]
+        self.average_deathrate = [[0, 0], [0, 0]]
+
+    def log(self, level, *args):
+        if self.verbosity >= level:
+            print(*args)
+
+    def average_rates(self):
+        """ Average birth and death probability of the last step, as [[tumour, tkiller], [tumour, tkiller]]."""
+
+        def average(total, count):
+            return total / count if count > 0 else float("nan")
+
+        return [[average(*self.average_birthrate[0]), average(*self.average_birthrate[1])],
+                [average(*self.average_deathrate[0]), average(*self.average_deathrate[1])]]
+
+    def log_average_rates(self):
+        if self.verbosity >= INFO:
+            average_birthrate, average_deathrate = self.average_rates()
+            print("Average Birthrate: ", average_birthrate[0])
+            print("Average Deathrate: ", average_deathrate[0])
+
+
+class MetricsSink:
+    """ Per-step counters kept in a fixed-size ring buffer and flushed in batches to CSV or Parquet.
+
+    Without a path only the last capacity steps are kept. With one, rows are written out whenever the ring is
+    full and on close(), so nothing is lost; a path ending in .parquet needs pyarrow.
+    """
+
+    def __init__(self, path=None, capacity=1024):
+        self.path = path
+        self.rows = np.zeros(capacity, dtype=METRICS_DTYPE)
+        self.count = 0
+        self.flushed = 0
+        self.parquet_writer = None
+
+    def __len__(self):
+        return min(self.count, len(self.rows))
+
+    def record(self, **values):
+        if self.path is not None and self.count - self.flushed >= len(self.rows):
+            self.flush()
+
+        slot = self.count % len(self.rows)
+        self.rows[slot] = 0
+        for name, value in values.items():
+            self.rows[name][slot] = value
+        self.count += 1
+
+    def latest(self):
+        """ The rows still held in memory, oldest first."""
+
+        return self.rows[np.arange(self.count - len(self), self.count) % len(self.rows)]
+
+    def flush(self):
+        if self.path is None:
+            return
+        pending = self.rows[np.arange(max(self.flushed, self.count - len(self.rows)), self.count) % len(self.rows)]
+        self.flushed = self.count
+        if len(pending) == 0:
+            return
+
+        if self.path.endswith(".parquet"):
+            import pyarrow
+            import pyarrow.parquet
+
+            table = pyarrow.table({name: pending[name] for name in METRICS_DTYPE.names})
+            if self.parquet_writer is None:
+                self.parquet_writer = pyarrow.parquet.ParquetWriter(self.path, table.schema)
+            self.parquet_writer.write_table(table)
+            return
+
+        new_file = not os.path.isfile(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, "a", newline="") as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(METRICS_DTYPE.names)
+            writer.writerows(pending.tolist())
+
+    def resume(self, iteration):
+        """ Continue the rows an earlier sink wrote to path, dropping those from iteration on.
+
+        Rows written after the checkpoint at iteration (by a later checkpoint or a full ring) would otherwise be
+        written again by the resumed run.
+        """
+
+        if self.path is None or not os.path.isfile(self.path):
+            return
+
+        if self.path.endswith(".parquet"):
+            import pyarrow
+            import pyarrow.parquet
+
+            table = pyarrow.parquet.read_table(self.path)
+            table = table.filter(pyarrow.array(table["iteration"].to_numpy() < iteration))
+            self.parquet_writer = pyarrow.parquet.ParquetWriter(self.path, table.schema)
+            self.parquet_writer.write_table(table)
+            return
+
+        with open(self.path, newline="") as f:
+            rows = list(csv.reader(f))
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerows(rows[:1] + [row for row in rows[1:] if int(row[0]) < iteration])
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        self.flush()
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+            self.parquet_writer = None
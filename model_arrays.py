@@ -0,0 +1,181 @@
+import numpy as np
+
+
+CELL_DTYPE = np.dtype([
+    ("unique_id", np.int64),
+    ("x", np.float64),
+    ("y", np.float64),
+    ("type", np.int8),
+    ("state", np.int8),
+    ("gamma", np.float64),
+    ("epsilon", np.float64),
+    ("delta", np.float64),
+    ("d", np.float64),
+])
+
+
+def param_value(value):
+    if value is None:
+        return np.nan
+    return value
+
+
+class CellArrays:
+    """ Structured-array storage for the cells of an array-backed ProcessModel."""
+
+    def __init__(self, capacity=1024):
+        self.data = np.zeros(capacity, dtype=CELL_DTYPE)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def cells(self):
+        return self.data[:self.size]
+
+    def append(self, records):
+        n = len(records)
+        if self.size + n > len(self.data):
+            data = np.zeros(max(2 * len(self.data), self.size + n), dtype=CELL_DTYPE)
+            data[:self.size] = self.cells
+            self.data = data
+        self.data[self.size:self.size + n] = records
+        self.size += n
+
+    def remove(self, indices):
+        keep = np.ones(self.size, dtype=bool)
+        keep[indices] = False
+        kept = self.cells[keep]
+        self.data[:len(kept)] = kept
+        self.size = len(kept)
+
+
+def birth_probabilities(model, cells, counts):
+    """ CellAgent.give_birth for every cell at once, from its [type 0/1, type 2] neighbour counts."""
+
+    types = cells["type"]
+    tumour = types != 2
+    sqrt_tumour = np.sqrt(counts[:, 0])
+
+    frequency_radius = np.asarray(model.frequency_radius, dtype=np.float64)[types[tumour]]
+    K = model.k * ((frequency_radius * frequency_radius) / (model.R * model.R))
+
+    prob_birth = np.empty(len(cells), dtype=np.float64)
+    prob_birth[tumour] = 1 - (sqrt_tumour[tumour] / K)
+    prob_birth[~tumour] = 1 - (counts[~tumour, 1] / (model.l + (model.a * sqrt_tumour[~tumour])))
+
+    return np.asarray(model.birth_rates, dtype=np.float64)[types] * prob_birth
+
+
+def death_probabilities(cells, counts, g):
+    """ CellAgent.cell_death for every cell at once."""
+
+    tumour = cells["type"] != 2
+    sqrt_tumour = np.sqrt(counts[:, 0])
+
+    prob_death = np.zeros(len(cells), dtype=np.float64)
+
+    crowded = tumour & (counts[:, 0] > 0)
+    mu = cells["gamma"][crowded] * (1 - (g * cells["epsilon"][crowded]))
+    prob_death[crowded] = cells["d"][crowded] + (mu * counts[crowded, 1] / sqrt_tumour[crowded])
+
+    prob_death[~tumour] = cells["d"][~tumour] + (cells["delta"][~tumour] * g * sqrt_tumour[~tumour])
+
+    return prob_death
+
+
+def evaluate_rates(model, cells, counts, g):
+    """ Birth and death probabilities of cells, evaluated in chunks by the model's workers when it has them."""
+
+    if model.chunk_workers is not None:
+        return model.chunk_workers.rates(model, cells, counts, g)
+    return birth_probabilities(model, cells, counts), death_probabilities(cells, counts, g)
+
+
+def record_average_rates(model, types, prob_birth, prob_death):
+    tumour = types != 2
+    for i, of_type in enumerate((tumour, ~tumour)):
+        model.average_birthrate[i][0] += prob_birth[of_type].sum()
+        model.average_birthrate[i][1] += int(of_type.sum())
+        model.average_deathrate[i][0] += prob_death[of_type].sum()
+        model.average_deathrate[i][1] += int(of_type.sum())
+
+
+def draw_offspring(model, prob_birth):
+    """ Number of offspring of every cell over the model.tau steps of one update, rates frozen over the leap."""
+
+    if model.tau == 1:
+        return (model.streams.birth.random(len(prob_birth)) <= prob_birth).astype(np.int64)
+    return model.streams.birth.binomial(model.tau, np.clip(prob_birth, 0, 1))
+
+
+def draw_deaths(model, prob_death):
+    """ Whether every cell dies within the model.tau steps of one update."""
+
+    if model.tau == 1:
+        return model.streams.death.random(len(prob_death)) <= prob_death
+    survival = (1 - np.clip(prob_death, 0, 1)) ** model.tau
+    return model.streams.death.random(len(prob_death)) < 1 - survival
+
+
+class ArrayEngine:
+    """ Steps every cell of a ProcessModel in one batched NumPy pass.
+
+    Mirrors CellAgent.step: neighbour counts, give_birth and cell_death are evaluated for all cells at
+    once, and births and deaths are kept pending until add_new_cells and delete_dead_cells commit them.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.cells = CellArrays()
+
+        self.births = np.zeros(0, dtype=CELL_DTYPE)
+        self.deaths = np.zeros(0, dtype=np.int64)
+
+    def step(self):
+        model = self.model
+        cells = self.cells.cells
+
+        profiler = model.profiler
+
+        with profiler.phase("neighbours"):
+            counts = model.current_neighbour_counts()
+        g = model.density_g
+
+        with profiler.phase("rates"):
+            prob_birth, prob_death = evaluate_rates(model, cells, counts, g)
+
+        with profiler.phase("give_birth"):
+            offspring = draw_offspring(model, prob_birth)
+
+        with profiler.phase("cell_death"):
+            dies = draw_deaths(model, prob_death)
+        record_average_rates(model, cells["type"], prob_birth, prob_death)
+
+        parents = np.repeat(cells, offspring)
+        births = parents.copy()
+        births["unique_id"] = [model.next_id() for _ in range(len(births))]
+        with profiler.phase("daughter_cell_pos"):
+            births["x"], births["y"] = model.offspring_positions(parents["x"], parents["y"], parents["type"])
+        births["state"] = 1
+        self.births = np.concatenate((self.births, births))
+
+        self.deaths = np.union1d(self.deaths, np.flatnonzero(dies))
+        cells["state"][dies] = 0
+
+    def add_new_cells(self):
+        births, self.births = self.births, np.zeros(0, dtype=CELL_DTYPE)
+        self.cells.append(births)
+        self.model.add_cell_positions(births["unique_id"], births["x"], births["y"], births["type"])
+
+        return np.bincount(births["type"], minlength=3).tolist()
+
+    def delete_dead_cells(self):
+        deaths, self.deaths = self.deaths, np.zeros(0, dtype=np.int64)
+        dead = self.cells.cells[deaths]
+        dead_types = np.bincount(dead["type"], minlength=3).tolist()
+        self.model.remove_cell_positions(dead["unique_id"], dead["type"])
+        self.cells.remove(deaths)
+
+        return dead_types
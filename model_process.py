@@ -1,24 +1,75 @@
+import multiprocessing
+import numbers
 from mesa import Model
 from mesa.space import ContinuousSpace
 from mesa.time import RandomActivation
 from model_cells import CellAgent
-import random
+from model_arrays import ArrayEngine
+from spatial_index import CellList
+from event_queue import EventQueue
+from position_buffer import PositionBuffer
+from model_random import RandomStreams
+from metrics import INFO, RateReporting
+from profiling import PhaseProfiler
+from dispersal import sample_offspring_positions
+from layouts import initial_cells
+from scheduling import SynchronousActivation
+from workers import WORKER_BACKENDS, update_chunk
+import numpy as np
 
 
-class ProcessModel(Model):
+def cooperative_fraction(density):
+    if density[0] + density[1] == 0:
+        return 0
+    return density[1]/(density[0] + density[1])
+
+
+class ProcessModel(Model, RateReporting):
 
     def __init__(self, initial_densities, width, height, density_radius=(1, 1, 1), frequency_radius=(1, 1, 1),
                  dispersal_radius=(1, 1, 1), max_cells_per_unit=10, deterministic_death=True, age_limit=20,
-                 death_ratio=0.2, death_period_limit=0, birth_rates=(0.2, 0.2, 0.2), k=25, l=20, a=1):
+                 death_ratio=0.2, death_period_limit=0, birth_rates=(0.2, 0.2, 0.2), k=25, l=20, a=1,
+                 engine="agents", seed=100, verbosity=INFO, profile=False, layout="uniform", layout_options=None,
+                 scheduler="random", tau=1, n_workers=1, worker_backend="processes"):
 
         super().__init__()
 
-        self.num_selfish, self.num_cooperative, self.num_tkiller = initial_densities
-        self.num_tumor_cells = self.num_selfish + self.num_cooperative
-        self.num_total = self.num_tumor_cells + self.num_tkiller
+        # Every draw of the model comes from these per-model streams; the mesa scheduler shuffles with
+        # its own self.random, seeded alongside them
+        self.streams = RandomStreams(seed)
+        self.reset_randomizer(seed)
+        self.verbosity = verbosity
+        self.profiler = PhaseProfiler(enabled=profile)
+        # With n_workers > 1 the neighbour counts, their updates for births and deaths, and the rates are evaluated
+        # in chunks by persistent worker processes over shared memory ("processes") or by a thread pool ("threads").
+        # A daemonic process (a sweep or strip worker) cannot start processes of its own, so there "processes" falls
+        # back to threads
+        if worker_backend not in WORKER_BACKENDS:
+            raise ValueError("Unknown worker_backend {!r}; use one of {}".format(
+                worker_backend, ", ".join(sorted(WORKER_BACKENDS))))
+        if worker_backend == "processes" and n_workers > 1 and multiprocessing.current_process().daemon:
+            worker_backend = "threads"
+        self.n_workers = n_workers
+        self.worker_backend = worker_backend
+        self.chunk_workers = WORKER_BACKENDS[worker_backend](n_workers) if n_workers > 1 else None
+
+        # "random" activates the agents one by one in shuffled order, "synchronous" evaluates them all at once;
+        # the array engine is always synchronous. Each step covers tau steps of the model (tau-leaping) when
+        # tau > 1, which needs a synchronous engine
+        if engine not in ("agents", "arrays"):
+            raise ValueError("Unknown engine {!r}; use \"agents\" or \"arrays\"".format(engine))
+        if scheduler not in ("random", "synchronous"):
+            raise ValueError("Unknown scheduler {!r}; use \"random\" or \"synchronous\"".format(scheduler))
+        self.scheduler = scheduler
+        # Offspring over a leap are drawn from a binomial over tau steps, so tau counts whole steps
+        if isinstance(tau, bool) or not isinstance(tau, numbers.Integral) or tau < 1:
+            raise ValueError("tau must be a positive whole number of steps, not {!r}".format(tau))
+        self.tau = int(tau)
+        if tau != 1 and engine != "arrays" and scheduler != "synchronous":
+            raise ValueError("tau-leaping (tau={}) needs scheduler=\"synchronous\" or engine=\"arrays\"".format(tau))
 
         self.space = ContinuousSpace(width, height, True)
-        self.schedule = RandomActivation(self)
+        self.schedule = SynchronousActivation(self) if scheduler == "synchronous" else RandomActivation(self)
 
         self.density_radius = density_radius
         self.frequency_radius = frequency_radius
@@ -33,162 +84,368 @@ class ProcessModel(Model):
         self.R = min(width, height)/2.0
         self.k, self.l, self.a = k, l, a
 
-        self.cells2add = []
-        self.cells2delete = []
-        self.all_cell_pos = [[], []]
-        self.pos_selfish_cells = [[], []]
-        self.pos_cooperative_cells = [[], []]
-        self.pos_tkiller_cells = [[], []]
-        self.pos_dead_cells = [[], []]
-
-        added_selfish, added_cooperative, added_tkiller = 0, 0, 0
-        random.seed(100)
-
-        def n_cells():
-            return added_selfish + added_cooperative + added_tkiller
-
-        mortality_rates = [random.uniform(0, 0.2), random.uniform(0, 0.2), random.uniform(0, 0.2)]
-        while n_cells() < self.num_total:
-
-            rnd_i = random.randrange(3)
-
-            if rnd_i == 0 and added_selfish < self.num_selfish:
-                a = CellAgent(n_cells(), self, rnd_i)
-                a.set_gamma(0.1)
-                a.set_epsilon(0.7)
-                a.set_d(mortality_rates[0])
-                added_selfish += 1
-
-            elif rnd_i == 1 and added_cooperative < self.num_cooperative:
-                a = CellAgent(n_cells(), self, rnd_i)
-                a.set_gamma(0.1)
-                a.set_epsilon(0.7)
-                a.set_d(mortality_rates[1])
-                added_cooperative += 1
-
-            elif rnd_i == 2 and added_tkiller < self.num_tkiller:
-                a = CellAgent(n_cells(), self, rnd_i)
-                a.set_gamma(0.1)
-                a.set_delta(0.001)
-                a.set_d(mortality_rates[2])
-                added_tkiller += 1
-
-            else:
-                continue
-
-            self.schedule.add(a)
-            centered = 0.2
-            center_width_min = self.space.center[0] - (0.5 * self.space.width)
-            center_width_max = self.space.center[0] + (0.5 * self.space.width)
-            center_height_min = self.space.center[1] - (0.5 * self.space.height)
-            center_height_max = self.space.center[1] + (0.5 * self.space.height)
-
-            # Add the agent to a random pos
-            x = random.uniform(center_width_min, center_width_max)
-            y = random.uniform(center_height_min, center_height_max)
-
-            self.space.place_agent(a, (x, y))
+        # "agents" steps one CellAgent at a time through the mesa schedule, "arrays" steps all cells at once
+        self.engine = ArrayEngine(self) if engine == "arrays" else None
+
+        self.neighbour_index = CellList(width, height, max(density_radius))
+        self.neighbour_index_stale = True
+        # Number of cells neighbour_index was last rebuilt for; births and deaths update it in place in between
+        self.neighbour_index_size = 0
+        # [type 0/1, type 2] neighbour counts of every cell in cell_positions() order, updated by add_new_cells
+        # and delete_dead_cells for the cells born and killed only; None until the first full count.
+        # The pair work per step scales with the births and deaths; what stays O(N) is compacting the counts,
+        # the index and the cells themselves, which are plain array copies without sorting or distance checks
+        self.neighbour_counts = None
+        # Neighbour counts of the agents by unique_id, only filled while the schedule steps
+        self.step_neighbour_counts = {}
+        # Cells owned by other parts of a partitioned domain that are counted as neighbours but never stepped
+        self.halo = None
+
+        # Running per-type cell counts, kept up to date by add_new_cells and delete_dead_cells
+        self.type_counts = [0, 0, 0]
+
+        self.cells2add = EventQueue()
+        self.cells2delete = EventQueue()
+        # Positions of the living cells of each type, keyed by unique_id; pos_*_cells[0] / [1] are x / y views
+        self.cell_pos = [PositionBuffer(), PositionBuffer(), PositionBuffer()]
+        self.pos_selfish_cells, self.pos_cooperative_cells, self.pos_tkiller_cells = self.cell_pos
+
+        with self.profiler.phase("initial_cells"):
+            cells = initial_cells(self.streams.init, initial_densities, width, height, layout, **(layout_options or {}))
+            self.add_initial_cells(cells)
 
         self.counter = 0
         self.density = []
-        self.average_birthrate = [[0, 0], [0, 0]]
-        self.average_deathrate = [[0, 0], [0, 0]]
+        self.density_g = self.g
+        self.reset_average_rates()
+
+    def add_initial_cells(self, cells):
+        """ Insert CELL_DTYPE records into the engine (or the schedule and space) and the position buffers at once."""
+
+        self.current_id = max(self.current_id, int(cells["unique_id"].max(initial=0)))
+        if self.engine is not None:
+            self.engine.cells.append(cells)
+        else:
+            agents = []
+            for unique_id, cell_type, gamma, epsilon, delta, d in zip(
+                    cells["unique_id"].tolist(), cells["type"].tolist(), cells["gamma"].tolist(),
+                    cells["epsilon"].tolist(), cells["delta"].tolist(), cells["d"].tolist()):
+                a = CellAgent(unique_id, self, cell_type)
+                a.set_gamma(gamma)
+                a.set_d(d)
+                if cell_type == 2:
+                    a.set_delta(delta)
+                else:
+                    a.set_epsilon(epsilon)
+                self.schedule.add(a)
+                agents.append(a)
+            self.place_agents(agents, list(zip(cells["x"].tolist(), cells["y"].tolist())))
+
+        self.add_cell_positions(cells["unique_id"], cells["x"], cells["y"], cells["type"])
+        self.type_counts = np.bincount(cells["type"], minlength=3).tolist()
+        self.num_selfish, self.num_cooperative, self.num_tkiller = self.type_counts
+        self.num_tumor_cells = self.num_selfish + self.num_cooperative
+        self.num_total = self.num_tumor_cells + self.num_tkiller
 
     @property
     def g(self):
-        density = self.get_density()
-        if density[0] + density[1] == 0:
-            return 0
-        return density[1]/(density[0] + density[1])
+        return cooperative_fraction(self.type_counts)
 
     def get_density(self, agents=None):
-        density = [0, 0, 0]
         if agents is None:
-            agents = self.schedule.agents
+            return list(self.type_counts)
+
+        density = [0, 0, 0]
         for cell in agents:
             density[cell.type] += 1
         return density
 
+    def cell_positions(self):
+        if self.engine is not None:
+            cells = self.engine.cells.cells
+            return cells["x"], cells["y"], cells["type"]
+
+        agents = self.schedule.agents
+        x = np.array([c.pos[0] for c in agents], dtype=np.float64)
+        y = np.array([c.pos[1] for c in agents], dtype=np.float64)
+        types = np.array([c.type for c in agents], dtype=np.int8)
+        return x, y, types
+
+    def set_halo(self, x, y, types):
+        self.halo = (np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64), np.asarray(types, dtype=np.int8))
+        self.neighbour_index_stale = True
+        self.neighbour_counts = None
+
+    def rebuild_neighbour_index(self, positions=None):
+        with self.profiler.phase("index_rebuild"):
+            if positions is None:
+                positions = self.cell_positions()
+            if self.halo is not None:
+                positions = [np.concatenate((own, halo)) for own, halo in zip(positions, self.halo)]
+            self.neighbour_index.rebuild(*positions)
+        self.neighbour_index_stale = False
+        self.neighbour_index_size = len(self.neighbour_index)
+
+    def count_neighbours(self, x, y, types):
+        """ Count [type 0/1, type 2] cells within density_radius of each position, rebuilding the index if stale."""
+
+        if self.neighbour_index_stale:
+            self.rebuild_neighbour_index()
+
+        radius = np.asarray(self.density_radius, dtype=np.float64)[np.asarray(types)]
+        with self.profiler.phase("neighbour_count"):
+            if self.chunk_workers is not None:
+                counts = self.chunk_workers.count_within(self.neighbour_index, x, y, radius)
+            else:
+                counts = self.neighbour_index.count_within(x, y, radius)
+        return np.column_stack((counts[:, 0] + counts[:, 1], counts[:, 2]))
+
+    def close(self):
+        """ Stop the chunk workers; the model stays usable, evaluating everything in this process."""
+
+        if self.chunk_workers is not None:
+            self.chunk_workers.close()
+            self.chunk_workers = None
+
+    def current_neighbour_counts(self):
+        """ The [type 0/1, type 2] neighbour counts of every cell in cell_positions() order."""
+
+        if self.neighbour_counts is None:
+            self.neighbour_counts = self.count_neighbours(*self.cell_positions())
+        return self.neighbour_counts
+
+    def update_neighbour_counts(self, x, y, types, sign):
+        """ Add (sign 1) or remove (sign -1) the cells at x, y to the neighbour counts of the indexed cells.
+
+        Returns the neighbour counts of the given cells among the indexed ones.
+        """
+
+        radius = np.asarray(self.density_radius, dtype=np.float64)
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        types = np.asarray(types, dtype=np.int64)
+        if self.chunk_workers is not None:
+            return self.chunk_workers.update_counts(self.neighbour_index, x, y, types, radius, sign,
+                                                    self.neighbour_counts)
+
+        counts = np.zeros((len(types), 2), dtype=np.int64)
+        update_chunk(self.neighbour_index, x, y, types, radius, sign, counts, self.neighbour_counts, slice(None))
+        return counts
+
+    def count_new_neighbours(self, n_old):
+        """ Count the neighbours of the cells appended after row n_old and add them to the counts around them."""
+
+        x, y, types = self.cell_positions()
+        # The bins were sized for the population at the last rebuild, so they are redrawn once it doubles or halves
+        size = self.neighbour_index_size
+        if self.neighbour_index_stale or not size / 2 <= n_old <= size * 2:
+            self.rebuild_neighbour_index([x[:n_old], y[:n_old], types[:n_old]])
+
+        new = slice(n_old, None)
+        counts = self.update_neighbour_counts(x[new], y[new], types[new], 1)
+
+        births_index = CellList(self.space.width, self.space.height, max(self.density_radius))
+        births_index.rebuild(x[new], y[new], types[new])
+        among_births = births_index.count_within(x[new], y[new],
+                                                 np.asarray(self.density_radius, dtype=np.float64)[types[new]])
+        counts[:, 0] += among_births[:, 0] + among_births[:, 1]
+        counts[:, 1] += among_births[:, 2]
+
+        self.neighbour_counts = np.concatenate((self.neighbour_counts, counts))
+        self.neighbour_index.insert(x[new], y[new], types[new])
+
+    def uncount_dead_neighbours(self, rows):
+        """ Remove the cells at rows from the neighbour counts of the cells around them, and their own counts."""
+
+        if self.neighbour_index_stale:
+            self.rebuild_neighbour_index()
+
+        x, y, types = self.cell_positions()
+        self.update_neighbour_counts(x[rows], y[rows], types[rows], -1)
+        self.neighbour_counts = np.delete(self.neighbour_counts, rows, axis=0)
+        self.neighbour_index.delete(rows)
+
+    def offspring_positions(self, parent_x, parent_y, types):
+        """ Sample one offspring position per parent within the dispersal radius of its type, on the torus."""
+
+        radius = np.asarray(self.dispersal_radius, dtype=np.float64)[np.asarray(types, dtype=np.int64)]
+        return sample_offspring_positions(self.streams.dispersal, parent_x, parent_y, radius,
+                                          self.space.width, self.space.height)
+
     def new_cell2add(self, cell):
-        if not self.cells2add.__contains__(cell):
-            self.cells2add.append(cell)
+        offspring, parent_pos = cell
+        self.cells2add.push(offspring, parent_pos)
 
     def new_cell2delete(self, cell):
-        if not self.cells2delete.__contains__(cell):
-            self.cells2delete.append(cell)
-
-    def add_cell_pos(self, pos, cell_type):
-
-        if cell_type == 0:
-            self.pos_selfish_cells[0].append(pos[0])
-            self.pos_selfish_cells[1].append(pos[1])
-        elif cell_type == 1:
-            self.pos_cooperative_cells[0].append(pos[0])
-            self.pos_cooperative_cells[1].append(pos[1])
-        elif cell_type == 2:
-            self.pos_tkiller_cells[0].append(pos[0])
-            self.pos_tkiller_cells[1].append(pos[1])
+        self.cells2delete.push(cell)
+
+    def place_agents(self, cells, positions):
+        """ Place many agents in the space with a single resize of its point array."""
+
+        space = self.space
+        if not hasattr(space, "_agent_to_index"):
+            for c, p in zip(cells, positions):
+                space.place_agent(c, p)
+            return
+
+        positions = [space.torus_adj(p) for p in positions]
+        if len(positions) == 0:
+            return
+
+        first = 0 if space._agent_points is None else len(space._agent_points)
+        new_points = np.array(positions, dtype=np.float64).reshape(-1, 2)
+        if space._agent_points is None:
+            space._agent_points = new_points
         else:
+            space._agent_points = np.concatenate((space._agent_points, new_points))
+
+        for i, (c, p) in enumerate(zip(cells, positions)):
+            space._index_to_agent[first + i] = c
+            space._agent_to_index[c] = first + i
+            c.pos = p
+
+    def remove_agents(self, cells):
+        """ Remove many agents from the space, reindexing the remaining ones once."""
+
+        space = self.space
+        if not hasattr(space, "_agent_to_index"):
+            for c in cells:
+                space.remove_agent(c)
             return
 
-    def clear_all_cell_pos(self):
-        self.pos_selfish_cells = [[], []]
-        self.pos_cooperative_cells = [[], []]
-        self.pos_tkiller_cells = [[], []]
+        if len(cells) == 0:
+            return
 
-    def step(self):
+        keep = np.ones(len(space._agent_points), dtype=bool)
+        for c in cells:
+            keep[space._agent_to_index.pop(c)] = False
+            c.pos = None
 
-        self.density = self.get_density()
-        self.average_birthrate = [[0, 0], [0, 0]]
-        self.average_deathrate = [[0, 0], [0, 0]]
+        kept = np.flatnonzero(keep)
+        space._agent_points = space._agent_points[kept]
+        space._index_to_agent = {i: space._index_to_agent[old] for i, old in enumerate(kept.tolist())}
+        space._agent_to_index = {c: i for i, c in space._index_to_agent.items()}
 
-        self.schedule.step()
-        self.counter = 0
+    def add_cell_pos(self, pos, cell_type, cell_id):
+        if 0 <= cell_type < len(self.cell_pos):
+            self.cell_pos[cell_type].add(cell_id, pos)
 
-        print("Average Birthrate: ", self.average_birthrate[0][0] / self.average_birthrate[0][1])
-        print("Average Deathrate: ", self.average_deathrate[0][0] / self.average_deathrate[0][1])
+    def remove_cell_pos(self, cell_type, cell_id):
+        if 0 <= cell_type < len(self.cell_pos):
+            self.cell_pos[cell_type].remove(cell_id)
+
+    def add_cell_positions(self, cell_ids, x, y, types):
+        for cell_type, buffer in enumerate(self.cell_pos):
+            of_type = types == cell_type
+            buffer.add_many(cell_ids[of_type], x[of_type], y[of_type])
+
+    def remove_cell_positions(self, cell_ids, types):
+        for cell_type, buffer in enumerate(self.cell_pos):
+            buffer.remove_many(cell_ids[types == cell_type])
+
+    def clear_all_cell_pos(self):
+        for buffer in self.cell_pos:
+            buffer.clear()
+
+    def step(self, type_counts=None):
+
+        # Births and deaths are only committed after the step, so the whole step sees the same density and g.
+        # A model holding one part of a partitioned domain is handed the type_counts of the whole domain instead
+        self.density = self.get_density() if type_counts is None else list(type_counts)
+        self.density_g = cooperative_fraction(self.density)
+        self.reset_average_rates()
+
+        self.profiler.next_step()
+        self.profiler.count("cells", sum(self.density))
+        with self.profiler.phase("step"):
+            if self.engine is None:
+                if self.scheduler != "synchronous":
+                    with self.profiler.phase("neighbours"):
+                        self.step_neighbour_counts = dict(zip([c.unique_id for c in self.schedule.agents],
+                                                              self.current_neighbour_counts().tolist()))
+                with self.profiler.phase("schedule"):
+                    self.schedule.step()
+                self.step_neighbour_counts = {}
+            else:
+                self.engine.step()
+                self.schedule.steps += 1
+                self.schedule.time += self.tau
+        self.counter = 0
+        self.log_average_rates()
 
     def add_new_cells(self):
 
-        added_types = [0, 0, 0]
-        for c, p in self.cells2add:
-            added_types[c.type] += 1
+        incremental = self.neighbour_counts is not None and self.halo is None
+        n_old = len(self.neighbour_counts) if incremental else 0
+        with self.profiler.phase("add_new_cells"):
+            if self.engine is not None:
+                added_types = self.engine.add_new_cells()
+            else:
+                added_types = self.add_new_agents()
+
+            if incremental:
+                with self.profiler.phase("neighbour_update"):
+                    self.count_new_neighbours(n_old)
+            else:
+                self.neighbour_index_stale = True
+                self.neighbour_counts = None
+        self.profiler.count("births", sum(added_types))
+
+        for cell_type in range(3):
+            self.type_counts[cell_type] += added_types[cell_type]
+        return added_types
+
+    def add_new_agents(self):
+
+        added_types = list(self.cells2add.type_counts)
+        births = self.cells2add.drain()
+        cells = [c for c, _ in births]
+        with self.profiler.phase("daughter_cell_pos"):
+            x, y = self.offspring_positions([p[0] for _, p in births], [p[1] for _, p in births],
+                                            [c.type for c in cells])
+
+        for c in cells:
             self.schedule.add(c)
-            self.space.place_agent(c, p)
-            self.add_cell_pos(p, c.type)
-            self.cells2add.remove((c, p))
+        self.place_agents(cells, list(zip(x.tolist(), y.tolist())))
+        for c in cells:
+            self.add_cell_pos(c.pos, c.type, c.unique_id)
 
         return added_types
 
+    def dead_rows(self):
+        if self.engine is not None:
+            return self.engine.deaths
+        rows = {c.unique_id: i for i, c in enumerate(self.schedule.agents)}
+        return np.array([rows[c.unique_id] for c, _ in self.cells2delete], dtype=np.int64)
+
     def delete_dead_cells(self):
 
-        dead_types = [0, 0, 0]
-        for c in self.cells2delete:
-            dead_types[c.type] += 1
-            removed_x, removed_y = False, False
-            if c.type == 0:
-                if self.pos_selfish_cells[0].__contains__(c.pos[0]):
-                    self.pos_selfish_cells[0].remove(c.pos[0])
-
-                if self.pos_selfish_cells[1].__contains__(c.pos[1]):
-                    self.pos_selfish_cells[1].remove(c.pos[1])
-                    removed_y = True
-            elif c.type == 1:
-                if self.pos_cooperative_cells[0].__contains__(c.pos[0]):
-                    self.pos_cooperative_cells[0].remove(c.pos[0])
-                    removed_x = True
-                if self.pos_cooperative_cells[1].__contains__(c.pos[1]):
-                    self.pos_cooperative_cells[1].remove(c.pos[1])
-                    removed_y = True
-            elif c.type == 2:
-                if self.pos_tkiller_cells[0].__contains__(c.pos[0]):
-                    self.pos_tkiller_cells[0].remove(c.pos[0])
-                    removed_x = True
-                if self.pos_tkiller_cells[1].__contains__(c.pos[1]):
-                    self.pos_tkiller_cells[1].remove(c.pos[1])
-                    removed_y = True
+        with self.profiler.phase("delete_dead_cells"):
+            if self.neighbour_counts is not None and self.halo is None:
+                with self.profiler.phase("neighbour_update"):
+                    self.uncount_dead_neighbours(self.dead_rows())
+            else:
+                self.neighbour_counts = None
+                self.neighbour_index_stale = True
+
+            if self.engine is not None:
+                dead_types = self.engine.delete_dead_cells()
+            else:
+                dead_types = self.delete_dead_agents()
+        self.profiler.count("deaths", sum(dead_types))
+
+        for cell_type in range(3):
+            self.type_counts[cell_type] -= dead_types[cell_type]
+        return dead_types
 
+    def delete_dead_agents(self):
+
+        dead_types = list(self.cells2delete.type_counts)
+        deaths = [c for c, _ in self.cells2delete.drain()]
+        for c in deaths:
+            self.remove_cell_pos(c.type, c.unique_id)
             self.schedule.remove(c)
-            self.cells2delete.remove(c)
+
+        self.remove_agents(deaths)
 
         return dead_types
\ No newline at end of file
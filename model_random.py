@@ -0,0 +1,24 @@
+import numpy as np
+
+
+class RandomStreams:
+    """ Independent random generators of one model, all derived from a single seed.
+
+    Each part of the model draws from its own stream, so changing how many numbers one part consumes (or the
+    order in which agents are activated) does not shift the draws of the others.
+    """
+
+    names = ("init", "birth", "death", "dispersal")
+
+    def __init__(self, seed=None):
+        self.seed = seed
+        self.seed_sequence = np.random.SeedSequence(seed)
+        for name, child in zip(self.names, self.seed_sequence.spawn(len(self.names))):
+            setattr(self, name, np.random.default_rng(child))
+
+    def get_state(self):
+        return {name: getattr(self, name).bit_generator.state for name in self.names}
+
+    def set_state(self, state):
+        for name in self.names:
+            getattr(self, name).bit_generator.state = state[name]
@@ -0,0 +1,87 @@
+import numpy as np
+
+
+class PositionBuffer:
+    """ Preallocated (2, capacity) store of cell positions keyed by unique_id, with swap-remove deletion.
+
+    buffer[0] and buffer[1] are zero-copy views of the x and y coordinates, so the buffer can be handed to
+    plotting code in place of the old [[x, ...], [y, ...]] lists.
+    """
+
+    def __init__(self, capacity=1024, dtype=np.float32):
+        self.data = np.empty((2, capacity), dtype=dtype)
+        self.keys = np.empty(capacity, dtype=np.int64)
+        self.slots = {}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, key):
+        return key in self.slots
+
+    def __getitem__(self, axis):
+        return self.data[axis, :self.size]
+
+    @property
+    def view(self):
+        return self.data[:, :self.size]
+
+    def reserve(self, capacity):
+        if capacity <= self.data.shape[1]:
+            return
+        capacity = max(capacity, 2 * self.data.shape[1])
+        data = np.empty((2, capacity), dtype=self.data.dtype)
+        data[:, :self.size] = self.view
+        keys = np.empty(capacity, dtype=np.int64)
+        keys[:self.size] = self.keys[:self.size]
+        self.data, self.keys = data, keys
+
+    def add(self, key, pos):
+        slot = self.slots.get(key)
+        if slot is None:
+            self.reserve(self.size + 1)
+            slot = self.size
+            self.slots[key] = slot
+            self.keys[slot] = key
+            self.size += 1
+        self.data[0, slot] = pos[0]
+        self.data[1, slot] = pos[1]
+
+    def add_many(self, keys, x, y):
+        keys = np.asarray(keys, dtype=np.int64)
+        if len(keys) == 0:
+            return
+        if any(key in self.slots for key in keys.tolist()):
+            for key, pos in zip(keys.tolist(), zip(x, y)):
+                self.add(key, pos)
+            return
+
+        self.reserve(self.size + len(keys))
+        stop = self.size + len(keys)
+        self.data[0, self.size:stop] = x
+        self.data[1, self.size:stop] = y
+        self.keys[self.size:stop] = keys
+        self.slots.update(zip(keys.tolist(), range(self.size, stop)))
+        self.size = stop
+
+    def remove(self, key):
+        slot = self.slots.pop(key, None)
+        if slot is None:
+            return False
+
+        last = self.size - 1
+        if slot != last:
+            self.data[:, slot] = self.data[:, last]
+            self.keys[slot] = self.keys[last]
+            self.slots[int(self.keys[slot])] = slot
+        self.size = last
+        return True
+
+    def remove_many(self, keys):
+        for key in np.asarray(keys, dtype=np.int64).tolist():
+            self.remove(key)
+
+    def clear(self):
+        self.slots = {}
+        self.size = 0
@@ -0,0 +1,111 @@
+import json
+import time
+from collections import defaultdict
+
+
+class NullPhase:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_PHASE = NullPhase()
+
+
+class Phase:
+
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.profiler.stack.append([self.name, 0.0])
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.start, time.perf_counter() - self.start)
+        return False
+
+
+class PhaseProfiler:
+    """ Named timers and counters around the phases of a simulation step.
+
+    When disabled, phase() hands out one shared no-op context manager and count() returns immediately. Timings
+    are kept per phase in total, per step (see breakdown and history) and per call stack for flame graphs. Only
+    phases nested at most trace_depth deep become Chrome trace events, so per-cell phases are aggregated instead
+    of logged one by one.
+    """
+
+    def __init__(self, enabled=False, trace_depth=2):
+        self.enabled = enabled
+        self.trace_depth = trace_depth
+        self.origin = time.perf_counter()
+        self.stack = []
+        self.totals = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.stack_totals = defaultdict(float)
+        self.events = []
+        self.history = []
+        self.current = defaultdict(float)
+
+    def phase(self, name):
+        if not self.enabled:
+            return NULL_PHASE
+        return Phase(self, name)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] += n
+            self.current["count:" + name] += n
+
+    def record(self, start, duration):
+        path = ";".join(name for name, _ in self.stack)
+        name, child_time = self.stack.pop()
+        if self.stack:
+            self.stack[-1][1] += duration
+
+        self.totals[name] += duration
+        self.calls[name] += 1
+        self.current[name] += duration
+        self.stack_totals[path] += duration - child_time
+        if len(self.stack) < self.trace_depth:
+            self.events.append((name, start - self.origin, duration, len(self.stack)))
+
+    def next_step(self):
+        """ Close the breakdown of the previous step; called at the start of every ProcessModel.step."""
+
+        if self.enabled and self.current:
+            self.history.append(dict(self.current))
+            self.current = defaultdict(float)
+
+    def breakdown(self):
+        """ Seconds spent per phase (and counts per counter) since the current step started."""
+
+        return dict(self.current)
+
+    def summary(self):
+        return {name: {"seconds": self.totals[name], "calls": self.calls[name]} for name in self.totals}
+
+    def write_chrome_trace(self, path):
+        """ Write the traced phases as Chrome trace events, viewable in chrome://tracing or Perfetto."""
+
+        events = [{"name": name, "ph": "X", "ts": start * 1e6, "dur": duration * 1e6, "pid": 0, "tid": 0,
+                   "args": {"depth": depth}}
+                  for name, start, duration, depth in self.events]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def write_folded(self, path):
+        """ Write self time per call stack in microseconds, in the folded format read by flamegraph.pl."""
+
+        with open(path, "w") as f:
+            for stack, seconds in sorted(self.stack_totals.items()):
+                f.write("{} {}\n".format(stack, int(round(seconds * 1e6))))
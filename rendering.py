@@ -0,0 +1,149 @@
+import collections
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import imageio
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+
+CELL_STYLES = (("r", "Selfish Cells"), ("b", "Cooperative Cells"), ("g", "T-Killer Cells"))
+
+
+def snapshot(i, model):
+    """ Copy the per-type positions of model so the frame can be drawn while the model keeps stepping."""
+
+    return i, [buffer.view.copy() for buffer in model.cell_pos]
+
+
+class ScatterFigure:
+    """ One reusable figure with a scatter artist per cell type, updated in place for every frame."""
+
+    def __init__(self, width, height, initial_densities):
+        self.initial_densities = initial_densities
+        self.figure = Figure()
+        FigureCanvasAgg(self.figure)
+        axes = self.figure.add_subplot()
+
+        self.artists = [axes.scatter([], [], c=color, s=4, label=label) for color, label in CELL_STYLES]
+        axes.set_xlim(0, width)
+        axes.set_ylim(0, height)
+        self.title = axes.set_title("")
+
+        selfish, cooperative, tkiller = self.artists
+        if initial_densities[0] == 0:
+            axes.legend(handles=[cooperative, tkiller], loc=7)
+        elif initial_densities[1] == 0:
+            axes.legend(handles=[selfish, tkiller], loc=7)
+        else:
+            axes.legend(handles=[selfish, cooperative, tkiller], loc=7)
+
+    def draw(self, frame):
+        i, positions = frame
+        for artist, pos in zip(self.artists, positions):
+            artist.set_offsets(np.column_stack((pos[0], pos[1])))
+        self.title.set_text("Iteration {}, Initial Density: [{}, {}, {}]".format(i, *self.initial_densities))
+
+    def save(self, path):
+        self.figure.savefig(path)
+
+    def to_rgb(self):
+        canvas = self.figure.canvas
+        canvas.draw()
+        return np.asarray(canvas.buffer_rgba())[:, :, :3].copy()
+
+
+class JpegSink:
+    """ Saves every frame as figN.jpg in directory; the workers save them straight from their figures."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def frame_path(self, i):
+        return os.path.join(self.directory, "fig{}.jpg".format(i))
+
+    def write(self, image):
+        pass
+
+    def close(self):
+        pass
+
+
+class AnimationSink:
+    """ Streams frames, as the RGB buffers the workers return, into one open imageio writer (GIF, MP4, ...)."""
+
+    def __init__(self, path, fps=10):
+        self.writer = imageio.get_writer(path, mode="I", fps=fps)
+
+    def frame_path(self, i):
+        return None
+
+    def write(self, image):
+        self.writer.append_data(image)
+
+    def close(self):
+        self.writer.close()
+
+
+# The figure of each render worker process (or of the one render thread), created once by init_worker
+worker_figure = None
+
+
+def init_worker(width, height, initial_densities):
+    global worker_figure
+    worker_figure = ScatterFigure(width, height, initial_densities)
+
+
+def render_frame(frame, path):
+    """ Draw frame in the worker's figure and save it to path, or return it as an RGB buffer without one."""
+
+    worker_figure.draw(frame)
+    if path is not None:
+        worker_figure.save(path)
+        return None
+    return worker_figure.to_rgb()
+
+
+class FrameRenderer:
+    """ Renders model frames into a sink (JpegSink or AnimationSink) in worker processes.
+
+    Drawing a frame with matplotlib holds the GIL nearly throughout, so worker threads would slow down
+    ProcessModel.step; worker processes only cost pickling the position snapshots, which are plain arrays.
+    submit() blocks only when max_pending frames are in flight, and frames reach the sink in submission order.
+    A daemonic process (a sweep worker) cannot start worker processes, so there the frames are drawn by a single
+    thread instead, which shares one figure.
+    """
+
+    def __init__(self, width, height, initial_densities, sink, n_workers=2, max_pending=8):
+        self.sink = sink
+        self.max_pending = max_pending
+        self.pending = collections.deque()
+        initargs = (width, height, initial_densities)
+        if multiprocessing.current_process().daemon:
+            self.pool = ThreadPoolExecutor(1, initializer=init_worker, initargs=initargs)
+        else:
+            self.pool = ProcessPoolExecutor(n_workers, initializer=init_worker, initargs=initargs)
+
+    def collect(self, wait=False):
+        """ Hand the finished frames at the head of the queue to the sink; with wait, all of them."""
+
+        while self.pending and (wait or self.pending[0].done()):
+            self.sink.write(self.pending.popleft().result())
+
+    def submit(self, i, model):
+        while len(self.pending) >= self.max_pending:
+            self.sink.write(self.pending.popleft().result())
+        frame = snapshot(i, model)
+        self.pending.append(self.pool.submit(render_frame, frame, self.sink.frame_path(i)))
+        self.collect()
+
+    def close(self):
+        try:
+            self.collect(wait=True)
+        finally:
+            self.pool.shutdown()
+            self.sink.close()
@@ -0,0 +1,56 @@
+import numpy as np
+from mesa.time import BaseScheduler
+
+from model_arrays import CELL_DTYPE, draw_deaths, draw_offspring, evaluate_rates, param_value, \
+    record_average_rates
+
+
+def agent_cells(agents):
+    """ The type and parameters of agents as CELL_DTYPE records, in the order given."""
+
+    cells = np.zeros(len(agents), dtype=CELL_DTYPE)
+    cells["type"] = [a.type for a in agents]
+    for name in ("gamma", "epsilon", "delta", "d"):
+        cells[name] = [param_value(getattr(a, name)) for a in agents]
+    return cells
+
+
+class SynchronousActivation(BaseScheduler):
+    """ Steps every agent at once against the snapshot taken at the start of ProcessModel.step.
+
+    Births and deaths are already deferred to add_new_cells and delete_dead_cells, so the outcome of a cell never
+    depends on those stepped before it: the birth and death probabilities of all agents are evaluated in one
+    vectorised pass and drawn in schedule order, without shuffling. With model.tau > 1 every step is a tau-leap
+    over tau steps with frozen rates (see draw_offspring and draw_deaths), and time advances by tau.
+    """
+
+    def step(self):
+        model = self.model
+        agents = self.agents
+        cells = agent_cells(agents)
+        profiler = model.profiler
+
+        with profiler.phase("neighbours"):
+            counts = model.current_neighbour_counts()
+
+        with profiler.phase("rates"):
+            prob_birth, prob_death = evaluate_rates(model, cells, counts, model.density_g)
+
+        with profiler.phase("give_birth"):
+            offspring = draw_offspring(model, prob_birth)
+
+        with profiler.phase("cell_death"):
+            dies = draw_deaths(model, prob_death)
+        record_average_rates(model, cells["type"], prob_birth, prob_death)
+
+        for i in np.flatnonzero(offspring).tolist():
+            parent = agents[i]
+            for _ in range(offspring[i]):
+                model.new_cell2add((parent.offspring(), parent.pos))
+
+        for i in np.flatnonzero(dies).tolist():
+            agents[i].state = 0
+            model.new_cell2delete(agents[i])
+
+        self.steps += 1
+        self.time += model.tau
@@ -0,0 +1,146 @@
+import numpy as np
+
+
+def chunk_slices(n, n_chunks=1, max_chunk=2 ** 16):
+    """ Split range(n) into at least n_chunks contiguous slices of at most max_chunk items."""
+
+    size = max(1, min(max_chunk, -(-n // max(n_chunks, 1))))
+    return [slice(start, min(start + size, n)) for start in range(0, n, size)]
+
+
+class CellList:
+    """ Uniform-grid cell list over a periodic width x height domain.
+
+    Points are bucketed into bins at least min_cell_size wide, so every neighbour within that radius lies in
+    the 3 x 3 block of bins around a query point. Bins are widened on sparse populations to keep the bin
+    table no larger than the number of points.
+    """
+
+    def __init__(self, width, height, min_cell_size):
+        self.width = width
+        self.height = height
+        self.min_cell_size = min_cell_size
+        self.rebuild(np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int8))
+
+    def __len__(self):
+        return len(self.x)
+
+    def rebuild(self, x, y, types):
+        n = len(x)
+        cell_size = max(self.min_cell_size, np.sqrt(self.width * self.height / max(n, 1)))
+        self.nx = max(1, int(self.width // cell_size))
+        self.ny = max(1, int(self.height // cell_size))
+        # Radius up to which the 3 x 3 block of bins is guaranteed to hold every neighbour
+        self.max_radius = min(np.inf if self.nx < 3 else self.width / self.nx,
+                              np.inf if self.ny < 3 else self.height / self.ny)
+
+        bins = self.bin_of(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+        self.order = np.argsort(bins, kind="stable")
+        self.x = np.asarray(x, dtype=np.float64)[self.order]
+        self.y = np.asarray(y, dtype=np.float64)[self.order]
+        self.types = np.asarray(types)[self.order]
+        self.starts = np.searchsorted(bins[self.order], np.arange(self.nx * self.ny + 1))
+
+    def insert(self, x, y, types):
+        """ Index more points in place, as rows len(self) onwards, each at the end of its bin; bins are not resized."""
+
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        bins = self.bin_of(x, y)
+        new = np.argsort(bins, kind="stable")
+        bins = bins[new]
+
+        at = self.starts[bins + 1]
+        self.x = np.insert(self.x, at, x[new])
+        self.y = np.insert(self.y, at, y[new])
+        self.types = np.insert(self.types, at, np.asarray(types)[new])
+        self.order = np.insert(self.order, at, len(self.order) + new)
+        self.starts[1:] += np.cumsum(np.bincount(bins, minlength=self.nx * self.ny))
+
+    def delete(self, rows):
+        """ Remove the points at rows in place; the rows after them move up, as in np.delete."""
+
+        dead = np.zeros(len(self.order), dtype=bool)
+        dead[rows] = True
+        keep = ~dead[self.order]
+
+        removed_bins = self.bin_of(self.x[~keep], self.y[~keep])
+        self.starts[1:] -= np.cumsum(np.bincount(removed_bins, minlength=self.nx * self.ny))
+        self.order = (np.cumsum(~dead) - 1)[self.order[keep]]
+        self.x, self.y, self.types = self.x[keep], self.y[keep], self.types[keep]
+
+    def bin_coords(self, x, y):
+        bx = (x * (self.nx / self.width)).astype(np.int64) % self.nx
+        by = (y * (self.ny / self.height)).astype(np.int64) % self.ny
+        return bx, by
+
+    def bin_of(self, x, y):
+        bx, by = self.bin_coords(x, y)
+        return bx * self.ny + by
+
+    def offsets(self, n_bins):
+        # With fewer than three bins along an axis the +-1 offsets would visit the same bin twice
+        if n_bins >= 3:
+            return (-1, 0, 1)
+        return tuple(range(n_bins))
+
+    def candidate_pairs(self, x, y, chunk_size=2 ** 16):
+        """ Yield (start, query, point, squared distance) for every point in the bins around each query.
+
+        query is relative to the chunk beginning at start, and point indexes the sorted storage; self.order
+        maps it back to the order given to rebuild.
+        """
+
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+
+        for start in range(0, len(x), chunk_size):
+            qx, qy = x[start:start + chunk_size], y[start:start + chunk_size]
+            bx, by = self.bin_coords(qx, qy)
+
+            for dx in self.offsets(self.nx):
+                for dy in self.offsets(self.ny):
+                    neighbour_bins = ((bx + dx) % self.nx) * self.ny + ((by + dy) % self.ny)
+                    first = self.starts[neighbour_bins]
+                    lengths = self.starts[neighbour_bins + 1] - first
+                    total = lengths.sum()
+                    if total == 0:
+                        continue
+
+                    query = np.repeat(np.arange(len(qx)), lengths)
+                    ends = np.cumsum(lengths)
+                    point = np.arange(total) - np.repeat(ends - lengths, lengths) + np.repeat(first, lengths)
+
+                    deltas_x = np.abs(self.x[point] - qx[query])
+                    deltas_y = np.abs(self.y[point] - qy[query])
+                    deltas_x = np.minimum(deltas_x, self.width - deltas_x)
+                    deltas_y = np.minimum(deltas_y, self.height - deltas_y)
+
+                    yield start, query, point, deltas_x ** 2 + deltas_y ** 2
+
+    def count_within(self, x, y, radius, n_types=3):
+        """ Count indexed points of each type within radius of every query point, excluding coincident ones.
+
+        Coincident points are skipped like ContinuousSpace.get_neighbors(..., include_center=False).
+        """
+
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        radius = np.broadcast_to(np.asarray(radius, dtype=np.float64), np.shape(x))
+        if len(radius) and radius.max() > self.max_radius:
+            raise ValueError("Query radius {} exceeds the cell list bin size {}".format(radius.max(),
+                                                                                       self.max_radius))
+
+        counts = np.zeros((len(radius), n_types), dtype=np.int64)
+        self.count_into(x, y, radius, counts)
+        return counts
+
+    def count_into(self, x, y, radius, counts):
+        """ count_within for a slice of the queries, adding into its rows of counts."""
+
+        n_types = counts.shape[1]
+        for start, query, point, dists in self.candidate_pairs(x, y):
+            within = (dists <= radius[start + query] ** 2) & (dists > 0)
+            chunk = counts[start:start + query[-1] + 1]
+            chunk += np.bincount(query[within] * n_types + self.types[point[within]],
+                                 minlength=chunk.size).reshape(chunk.shape)
@@ -0,0 +1,172 @@
+import os
+
+import numpy as np
+
+from spatial_index import CellList
+
+
+TYPE_NAMES = ("selfish", "cooperative", "tkiller")
+TYPE_PAIRS = ((0, 0), (0, 1), (0, 2), (1, 1), (1, 2), (2, 2))
+
+
+def connected_components(n, a, b):
+    """ Label n points joined by the edges (a, b) with the smallest index of their component."""
+
+    labels = np.arange(n)
+    while True:
+        la, lb = labels[a], labels[b]
+        differ = la != lb
+        if not differ.any():
+            return labels
+
+        # Hook every root onto the smallest root it is joined to, then jump until each label is a root again
+        high = np.maximum(la[differ], lb[differ])
+        low = np.minimum(la[differ], lb[differ])
+        order = np.lexsort((low, high))
+        high, low = high[order], low[order]
+        first = np.r_[True, high[1:] != high[:-1]]
+        labels[high[first]] = low[first]
+        while True:
+            parent = labels[labels]
+            if np.array_equal(parent, labels):
+                break
+            labels = parent
+
+
+class SpatialStatistics:
+    """ Spatial summary statistics of a model, sampled every every steps of a run and stored compactly.
+
+    Each sample takes one binned pass over the cell pairs within r_max on the torus and stores, per type pair of
+    TYPE_PAIRS, the pair correlation g(r) over n_bins distance bins and Ripley's K at the outer bin edges (pi r^2
+    for a uniformly random population, larger where the pair is aggregated); the mean and standard deviation
+    over tumour cells of the local g, the cooperative fraction of the tumour cells within local_radius; and per
+    type the number of clusters and the size of the largest, a cluster joining cells of one type closer than
+    cluster_radius. With a path the samples are (re)written there as an .npz file by save().
+    """
+
+    def __init__(self, width, height, path=None, every=1, r_max=3.0, n_bins=15, local_radius=1.0,
+                 cluster_radius=1.0):
+        self.width, self.height = width, height
+        self.path = path
+        self.every = every
+        self.r_max = min(r_max, min(width, height) / 2)
+        self.edges = np.linspace(0, self.r_max, n_bins + 1)
+        self.local_radius = local_radius
+        self.cluster_radius = cluster_radius
+        self.index = CellList(width, height, max(self.r_max, local_radius, cluster_radius))
+        self.samples = []
+
+    def __len__(self):
+        return len(self.samples)
+
+    def pass_pairs(self, x, y, types):
+        """ Pair distance histogram per ordered type pair, local type counts and same-type cluster edges."""
+
+        n_bins = len(self.edges) - 1
+        histogram = np.zeros(9 * n_bins, dtype=np.int64)
+        local = np.zeros((len(x), 3), dtype=np.int64)
+        links = []
+
+        self.index.rebuild(x, y, types)
+        # Blocks of r_max-wide bins hold many candidates per query, so smaller chunks keep them in cache
+        for start, query, point, dists in self.index.candidate_pairs(x, y, chunk_size=2 ** 12):
+            query_type = types[start + query]
+            point_type = self.index.types[point]
+
+            near = (dists > 0) & (dists < self.r_max ** 2)
+            distance_bin = np.minimum((np.sqrt(dists[near]) * (n_bins / self.r_max)).astype(np.int64), n_bins - 1)
+            histogram += np.bincount((query_type[near] * 3 + point_type[near]) * n_bins + distance_bin,
+                                     minlength=histogram.size)
+
+            within = (dists <= self.local_radius ** 2) & (dists > 0)
+            chunk = local[start:start + query[-1] + 1]
+            chunk += np.bincount(query[within] * 3 + point_type[within], minlength=chunk.size).reshape(chunk.shape)
+
+            # Each pair is seen from both ends, so only the one from the lower index is kept
+            a, b = start + query, self.index.order[point]
+            linked = (dists <= self.cluster_radius ** 2) & (query_type == point_type) & (a < b)
+            links.append((a[linked], b[linked]))
+
+        a = np.concatenate([pair[0] for pair in links]) if links else np.zeros(0, dtype=np.int64)
+        b = np.concatenate([pair[1] for pair in links]) if links else np.zeros(0, dtype=np.int64)
+        return histogram.reshape(3, 3, n_bins), local, (a, b)
+
+    def compute(self, x, y, types):
+        """ The statistics of one population, as a dict of arrays."""
+
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        types = np.asarray(types, dtype=np.int64)
+        area = self.width * self.height
+        counts = np.bincount(types, minlength=3).astype(np.float64)
+        histogram, local, (a, b) = self.pass_pairs(x, y, types)
+
+        annuli = np.pi * np.diff(self.edges ** 2)
+        pair_correlation = np.full((len(TYPE_PAIRS), len(annuli)), np.nan)
+        ripley_k = np.full_like(pair_correlation, np.nan)
+        for p, (i, j) in enumerate(TYPE_PAIRS):
+            # Ordered pairs: a pair of one type is counted from both ends, a mixed pair once each way
+            pairs = histogram[i, j] if i == j else (histogram[i, j] + histogram[j, i]) / 2
+            expected = counts[i] * (counts[i] - 1 if i == j else counts[j]) / area
+            if expected > 0:
+                pair_correlation[p] = pairs / (expected * annuli)
+                ripley_k[p] = np.cumsum(pairs) / expected
+
+        tumour_neighbours = local[:, 0] + local[:, 1]
+        measured = (types != 2) & (tumour_neighbours > 0)
+        local_g = local[measured, 1] / tumour_neighbours[measured]
+
+        labels = connected_components(len(x), a, b)
+        clusters = np.zeros(3, dtype=np.int64)
+        largest = np.zeros(3, dtype=np.int64)
+        for cell_type in range(3):
+            _, sizes = np.unique(labels[types == cell_type], return_counts=True)
+            clusters[cell_type] = len(sizes)
+            largest[cell_type] = sizes.max() if len(sizes) else 0
+
+        return {
+            "pair_correlation": pair_correlation.astype(np.float32),
+            "ripley_k": ripley_k.astype(np.float32),
+            "local_g_mean": local_g.mean() if len(local_g) else np.nan,
+            "local_g_std": local_g.std() if len(local_g) else np.nan,
+            "clusters": clusters,
+            "largest_cluster": largest,
+        }
+
+    def sample(self, step, model):
+        """ Compute and keep the statistics of model if step is a multiple of every."""
+
+        if self.every <= 0 or step % self.every != 0:
+            return None
+        with model.profiler.phase("spatial_statistics"):
+            statistics = self.compute(*model.cell_positions())
+        self.samples.append(dict(statistics, step=step))
+        return statistics
+
+    def results(self):
+        """ All samples stacked into arrays, with steps, bin edges and pair names alongside."""
+
+        names = ("step", "pair_correlation", "ripley_k", "local_g_mean", "local_g_std", "clusters",
+                 "largest_cluster")
+        results = {name: np.array([sample[name] for sample in self.samples]) for name in names}
+        results["edges"] = self.edges
+        results["pairs"] = np.array(["{}-{}".format(TYPE_NAMES[i], TYPE_NAMES[j]) for i, j in TYPE_PAIRS])
+        return results
+
+    def save(self):
+        if self.path is None or not self.samples:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(f, **self.results())
+        os.replace(tmp_path, self.path)
+
+    def resume(self, step):
+        """ Continue the samples saved at path up to step, where the run was checkpointed."""
+
+        if self.path is None or not os.path.isfile(self.path):
+            return
+        with np.load(self.path) as f:
+            saved = {name: f[name] for name in f.files}
+        for row in np.flatnonzero(saved["step"] <= step).tolist():
+            self.samples.append({name: saved[name][row] for name in saved if name not in ("edges", "pairs")})
@@ -0,0 +1,120 @@
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import os
+from multiprocessing import Pool, cpu_count
+
+from main import run
+from metrics import QUIET
+
+
+def expand_grid(grid):
+    """ Expand {"parameter": [value, ...], ...} into one configuration per combination of values."""
+
+    if "seed" in grid:
+        raise ValueError("The grid cannot vary seed; give the seeds with --seeds (the seeds argument of sweep)")
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def run_id(config, seed):
+    key = json.dumps({"config": config, "seed": seed}, sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def load_results(path):
+    """ Read every completed run from a results file; a line cut short by an interruption is skipped."""
+
+    results = []
+    if not os.path.isfile(path):
+        return results
+
+    with open(path) as f:
+        for line in f:
+            try:
+                results.append(json.loads(line))
+            except ValueError:
+                continue
+    return results
+
+
+def run_task(task):
+    config, seed = task
+
+    result = run(seed=seed, **dict({"verbosity": QUIET}, **config))
+
+    result.update({"run_id": run_id(config, seed), "config": config, "seed": seed})
+    return result
+
+
+def sweep(grid, seeds, results_path, processes=None):
+    """ Run every configuration of grid once per seed in a process pool, skipping runs already in results_path.
+
+    Each finished run is appended to results_path as one JSON line, so an interrupted sweep resumes where it
+    stopped when called again with the same arguments.
+    """
+
+    done = {result["run_id"] for result in load_results(results_path)}
+    tasks = []
+    for config in expand_grid(grid):
+        config.setdefault("plot_frequency", 0)
+        for seed in seeds:
+            if run_id(config, seed) not in done:
+                tasks.append((config, seed))
+
+    print("{} runs to do, {} already done".format(len(tasks), len(done)))
+    if not tasks:
+        return load_results(results_path)
+
+    with Pool(processes or cpu_count()) as pool, open(results_path, "a") as f:
+        for i, result in enumerate(pool.imap_unordered(run_task, tasks)):
+            f.write(json.dumps(result) + "\n")
+            f.flush()
+            print("{}/{} runs done".format(i + 1, len(tasks)))
+
+    return load_results(results_path)
+
+
+def results_table(results):
+    """ Flatten runs into one row per (run, iteration) with the cell counts of each type."""
+
+    rows = []
+    for result in results:
+        for iteration, density in enumerate(result["densities"]):
+            row = {"run_id": result["run_id"], "seed": result["seed"]}
+            row.update({name: value if isinstance(value, (int, float, str)) else json.dumps(value)
+                        for name, value in sorted(result["config"].items())})
+            row.update({"iteration": iteration, "selfish": density[0], "cooperative": density[1],
+                        "tkiller": density[2], "equilibrium": result["equilibrium"] or ""})
+            rows.append(row)
+    return rows
+
+
+def write_table(rows, path):
+    fieldnames = []
+    for row in rows:
+        fieldnames.extend(name for name in row if name not in fieldnames)
+
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run a ProcessModel parameter sweep in a process pool.")
+    parser.add_argument("grid", help='JSON file mapping run() arguments to value lists, e.g. '
+                                     '{"initial_density": [[100, 100, 100]], "k": [20, 25]}')
+    parser.add_argument("--seeds", type=int, nargs="+", default=[100])
+    parser.add_argument("--results", default="sweep_results.jsonl")
+    parser.add_argument("--table", default="sweep_results.csv")
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    with open(args.grid) as f:
+        parameter_grid = json.load(f)
+
+    write_table(results_table(sweep(parameter_grid, args.seeds, args.results, args.processes)), args.table)
@@ -0,0 +1,166 @@
+import os
+
+import numpy as np
+
+
+COLUMNS = {
+    "cells": (("unique_id", np.int64), ("x", np.float32), ("y", np.float32), ("type", np.int8)),
+    "births": (("unique_id", np.int64), ("x", np.float32), ("y", np.float32), ("type", np.int8)),
+    "deaths": (("unique_id", np.int64), ("x", np.float32), ("y", np.float32), ("type", np.int8)),
+}
+
+INDEX_DTYPE = np.dtype([("step", np.int64), ("segment", np.int64),
+                        ("cells_start", np.int64), ("cells_stop", np.int64),
+                        ("births_start", np.int64), ("births_stop", np.int64),
+                        ("deaths_start", np.int64), ("deaths_stop", np.int64)])
+
+
+def model_cells(model):
+    """ The living cells of model, sorted by unique_id, read from its per-type position buffers."""
+
+    buffers = model.cell_pos
+    cells = {
+        "unique_id": np.concatenate([buffer.keys[:len(buffer)] for buffer in buffers]),
+        "x": np.concatenate([buffer[0] for buffer in buffers]),
+        "y": np.concatenate([buffer[1] for buffer in buffers]),
+        "type": np.concatenate([np.full(len(buffer), cell_type, dtype=np.int8)
+                                for cell_type, buffer in enumerate(buffers)]),
+    }
+    order = np.argsort(cells["unique_id"], kind="stable")
+    return {name: values[order] for name, values in cells.items()}
+
+
+def segment_path(directory, table, segment, column):
+    return os.path.join(directory, "{}_{:06d}_{}.npy".format(table, segment, column))
+
+
+class TrajectoryRecorder:
+    """ Appends every recorded step of a model to a directory of columnar .npy segments.
+
+    Each step stores the living cells (unique_id, x, y, type) plus the cells born and killed since the previous
+    recorded step, found by diffing the ids. Rows are buffered and written as one segment per column once
+    chunk_rows cells have accumulated; a segment always holds whole steps. The segments are left uncompressed so
+    TrajectoryReader can memory-map them, and positions are stored as float32 to keep them compact.
+    """
+
+    def __init__(self, directory, chunk_rows=2 ** 20):
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.chunk_rows = chunk_rows
+        self.segment = 0
+        self.index = []
+        self.previous = None
+        self.reset_buffers()
+
+    def resume(self, step, model):
+        """ Continue a trajectory written by an earlier recorder from step, where model was checkpointed.
+
+        Steps recorded after step are dropped from the index; new segments are numbered after the existing ones.
+        """
+
+        path = os.path.join(self.directory, "index.npy")
+        if os.path.isfile(path):
+            index = np.load(path)
+            if len(index):
+                self.segment = int(index["segment"].max()) + 1
+            self.index = [tuple(row) for row in index[index["step"] <= step].tolist()]
+            np.save(path, np.array(self.index, dtype=INDEX_DTYPE))
+        self.previous = model_cells(model)
+
+    def reset_buffers(self):
+        self.buffers = {table: {name: [] for name, _ in columns} for table, columns in COLUMNS.items()}
+        self.rows = {table: 0 for table in COLUMNS}
+        self.pending_index = []
+
+    def append(self, table, rows):
+        start = self.rows[table]
+        for name, dtype in COLUMNS[table]:
+            self.buffers[table][name].append(np.asarray(rows[name], dtype=dtype))
+        self.rows[table] += len(rows["unique_id"])
+        return start, self.rows[table]
+
+    def record(self, step, model):
+        cells = model_cells(model)
+
+        if self.previous is None:
+            births = {name: values[:0] for name, values in cells.items()}
+            deaths = births
+        else:
+            born = ~np.isin(cells["unique_id"], self.previous["unique_id"], assume_unique=True)
+            died = ~np.isin(self.previous["unique_id"], cells["unique_id"], assume_unique=True)
+            births = {name: values[born] for name, values in cells.items()}
+            deaths = {name: values[died] for name, values in self.previous.items()}
+
+        cells_start, cells_stop = self.append("cells", cells)
+        births_start, births_stop = self.append("births", births)
+        deaths_start, deaths_stop = self.append("deaths", deaths)
+        self.pending_index.append((step, self.segment, cells_start, cells_stop, births_start, births_stop,
+                                   deaths_start, deaths_stop))
+        self.previous = cells
+
+        if self.rows["cells"] >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.pending_index:
+            return
+
+        for table, columns in COLUMNS.items():
+            for name, dtype in columns:
+                values = np.concatenate(self.buffers[table][name]) if self.buffers[table][name] else \
+                    np.zeros(0, dtype=dtype)
+                np.save(segment_path(self.directory, table, self.segment, name), values)
+
+        self.index.extend(self.pending_index)
+        np.save(os.path.join(self.directory, "index.npy"), np.array(self.index, dtype=INDEX_DTYPE))
+
+        self.segment += 1
+        self.reset_buffers()
+
+    def close(self):
+        self.flush()
+
+
+class TrajectoryReader:
+    """ Memory-mapped access to a recorded trajectory; only the segments a step lives in are touched."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index = np.load(os.path.join(directory, "index.npy"))
+        self.columns = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def steps(self):
+        return self.index["step"]
+
+    def column(self, table, segment, name):
+        key = (table, segment, name)
+        if key not in self.columns:
+            path = segment_path(self.directory, table, segment, name)
+            try:
+                self.columns[key] = np.load(path, mmap_mode="r")
+            except ValueError:
+                # Empty arrays cannot be memory-mapped
+                self.columns[key] = np.load(path)
+        return self.columns[key]
+
+    def read(self, row, table):
+        start, stop = row[table + "_start"], row[table + "_stop"]
+        return {name: self.column(table, int(row["segment"]), name)[start:stop] for name, _ in COLUMNS[table]}
+
+    def frame(self, step, table="cells"):
+        """ Return the columns of table ("cells", "births" or "deaths") at step as memory-mapped views."""
+
+        rows = np.flatnonzero(self.index["step"] == step)
+        if len(rows) == 0:
+            raise KeyError("Step {} was not recorded".format(step))
+        return self.read(self.index[rows[-1]], table)
+
+    def __iter__(self):
+        for row in self.index:
+            yield int(row["step"]), self.read(row, "cells")
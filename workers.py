@@ -0,0 +1,281 @@
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from types import SimpleNamespace
+
+import numpy as np
+
+from model_arrays import birth_probabilities, death_probabilities
+from spatial_index import CellList, chunk_slices
+
+
+# What a worker needs of a CellList to count neighbours in it, and of a ProcessModel to evaluate birth rates
+INDEX_FIELDS = ("width", "height", "nx", "ny", "max_radius")
+INDEX_ARRAYS = ("x", "y", "types", "order", "starts")
+RATE_PARAMETERS = ("birth_rates", "frequency_radius", "k", "l", "a", "R")
+
+# Fewer cells than this per worker are not worth the round trip, so small populations use fewer workers
+MIN_CHUNK = 2 ** 12
+
+
+def rate_parameters(model):
+    return SimpleNamespace(**{name: getattr(model, name) for name in RATE_PARAMETERS})
+
+
+def worker_chunks(n, n_workers):
+    """ At most n_workers contiguous slices of range(n), each of at least MIN_CHUNK items."""
+
+    n_chunks = max(1, min(n_workers, n // MIN_CHUNK))
+    return chunk_slices(n, n_chunks, max_chunk=max(n, 1))
+
+
+def count_chunk(index, x, y, radius, counts, chunk):
+    index.count_into(x[chunk], y[chunk], radius[chunk], counts[chunk])
+
+
+def update_chunk(index, x, y, types, radius, sign, counts, deltas, chunk):
+    """ Count the indexed cells around the cells in chunk into counts, and add sign times the cells in chunk to
+    the counts of the indexed cells around them in deltas.
+
+    Both sides of a pair check their own density radius, and counts and deltas hold [type 0/1, type 2] per row,
+    deltas in the order of the rows given to index.rebuild.
+    """
+
+    x, y, types, own = x[chunk], y[chunk], types[chunk], counts[chunk]
+    for start, query, point, dists in index.candidate_pairs(x, y):
+        query = start + query
+        row, row_types = index.order[point], index.types[point]
+        near = dists > 0
+        seen = near & (dists <= radius[types[query]] ** 2)
+        own += np.bincount(query[seen] * 2 + (row_types[seen] == 2), minlength=own.size).reshape(own.shape)
+        sees = near & (dists <= radius[row_types] ** 2)
+        deltas += sign * np.bincount(row[sees] * 2 + (types[query[sees]] == 2),
+                                     minlength=deltas.size).reshape(deltas.shape)
+
+
+def rates_chunk(parameters, cells, counts, g, prob_birth, prob_death, chunk):
+    prob_birth[chunk] = birth_probabilities(parameters, cells[chunk], counts[chunk])
+    prob_death[chunk] = death_probabilities(cells[chunk], counts[chunk], g)
+
+
+def serve(command, args, view):
+    if command in ("count", "update"):
+        fields, arrays, *args = args
+        index = CellList.__new__(CellList)
+        index.__dict__.update(fields)
+        for name, spec in arrays.items():
+            setattr(index, name, view(spec))
+
+    if command == "count":
+        x, y, radius, counts, chunk = args
+        count_chunk(index, view(x), view(y), view(radius), view(counts), chunk)
+
+    elif command == "update":
+        x, y, types, radius, sign, counts, deltas, (k, chunk) = args
+        update_chunk(index, view(x), view(y), view(types), radius, sign, view(counts), view(deltas)[k], chunk)
+
+    elif command == "rates":
+        parameters, cells, counts, g, prob_birth, prob_death, chunk = args
+        rates_chunk(parameters, view(cells), view(counts), g, view(prob_birth), view(prob_death), chunk)
+
+
+def chunk_worker(connection):
+    """ Evaluate the chunks a ChunkProcesses sends, reading and writing its shared blocks, until told to close."""
+
+    blocks = {}
+
+    def view(spec):
+        name, dtype, shape = spec
+        if name not in blocks:
+            blocks[name] = shared_memory.SharedMemory(name=name)
+        return np.ndarray(shape, dtype=dtype, buffer=blocks[name].buf)
+
+    while True:
+        command, *args = connection.recv()
+
+        if command == "forget":
+            name, = args
+            if name in blocks:
+                blocks.pop(name).close()
+            continue
+
+        if command == "close":
+            for block in blocks.values():
+                block.close()
+            connection.close()
+            return
+
+        try:
+            serve(command, args, view)
+            connection.send(None)
+        except Exception as e:
+            connection.send(e)
+
+
+class ChunkThreads:
+    """ Evaluates the neighbour counts, their updates for births and deaths, and the rates of a step in contiguous
+    chunks over a persistent thread pool.
+
+    The chunks share the model's arrays directly and write into their own slices of preallocated outputs. Only
+    the parts of the NumPy calls that release the GIL run concurrently, so compare with ChunkProcesses (see
+    benchmark.py --workers and --backends) on the target host.
+    """
+
+    def __init__(self, n_workers):
+        self.n_workers = n_workers
+        self.executor = ThreadPoolExecutor(n_workers)
+
+    def map(self, function, n):
+        chunks = worker_chunks(n, self.n_workers)
+        if len(chunks) < 2:
+            for chunk in chunks:
+                function(chunk)
+        else:
+            list(self.executor.map(function, chunks))
+
+    def count_within(self, index, x, y, radius, n_types=3):
+        radius = np.broadcast_to(np.asarray(radius, dtype=np.float64), np.shape(x))
+        counts = np.zeros((len(radius), n_types), dtype=np.int64)
+        self.map(lambda chunk: count_chunk(index, x, y, radius, counts, chunk), len(x))
+        return counts
+
+    def update_counts(self, index, x, y, types, radius, sign, neighbour_counts):
+        """ The neighbour counts of the cells at x, y among the indexed ones; sign times the cells are added to
+        neighbour_counts, the counts of the indexed cells (see update_chunk).
+        """
+
+        chunks = worker_chunks(len(x), self.n_workers)
+        counts = np.zeros((len(x), 2), dtype=np.int64)
+        if len(chunks) < 2:
+            update_chunk(index, x, y, types, radius, sign, counts, neighbour_counts, slice(None))
+            return counts
+
+        # Every chunk scatters into rows all over the population, so each gets its own deltas to sum afterwards
+        deltas = np.zeros((len(chunks),) + neighbour_counts.shape, dtype=np.int64)
+        list(self.executor.map(lambda k: update_chunk(index, x, y, types, radius, sign, counts, deltas[k], chunks[k]),
+                               range(len(chunks))))
+        neighbour_counts += deltas.sum(axis=0)
+        return counts
+
+    def rates(self, model, cells, counts, g):
+        prob_birth = np.empty(len(cells), dtype=np.float64)
+        prob_death = np.empty(len(cells), dtype=np.float64)
+        self.map(lambda chunk: rates_chunk(model, cells, counts, g, prob_birth, prob_death, chunk), len(cells))
+        return prob_birth, prob_death
+
+    def close(self):
+        self.executor.shutdown()
+
+
+class ChunkProcesses:
+    """ Evaluates the neighbour counts, their updates for births and deaths, and the rates of a step in contiguous
+    chunks over persistent worker processes.
+
+    The inputs are copied once per step into shared-memory blocks that the workers map, and every worker writes
+    its chunk straight into shared output blocks, so nothing but the block names and a few parameters is pickled.
+    The blocks are reused from step to step and only reallocated when the population outgrows them.
+    """
+
+    def __init__(self, n_workers):
+        if multiprocessing.current_process().daemon:
+            raise ValueError("ChunkProcesses cannot start worker processes from a daemonic process; use ChunkThreads")
+        self.n_workers = n_workers
+        self.blocks = {}
+        self.connections, self.workers = [], []
+        # Workers forked before the resource tracker runs would start their own, which would unlink the blocks
+        # they attached to when they exit
+        resource_tracker.ensure_running()
+        for _ in range(n_workers):
+            parent, child = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=chunk_worker, args=(child,), daemon=True)
+            worker.start()
+            self.connections.append(parent)
+            self.workers.append(worker)
+
+    def block(self, key, shape, dtype):
+        """ The spec and a view of the shared array for key, reallocated with some headroom when too small."""
+
+        dtype = np.dtype(dtype)
+        nbytes = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        block = self.blocks.get(key)
+        if block is None or block.size < nbytes:
+            if block is not None:
+                for connection in self.connections:
+                    connection.send(("forget", block.name))
+                block.close()
+                block.unlink()
+            block = self.blocks[key] = shared_memory.SharedMemory(create=True, size=nbytes + nbytes // 2)
+        return (block.name, dtype, tuple(shape)), np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    def share(self, key, array):
+        array = np.asarray(array)
+        spec, view = self.block(key, array.shape, array.dtype)
+        view[...] = array
+        return spec
+
+    def run(self, command, chunks, *args):
+        for connection, chunk in zip(self.connections, chunks):
+            connection.send((command,) + args + (chunk,))
+        errors = [connection.recv() for connection in self.connections[:len(chunks)]]
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def count_within(self, index, x, y, radius, n_types=3):
+        chunks = worker_chunks(len(x), self.n_workers)
+        if len(chunks) < 2:
+            return index.count_within(x, y, radius, n_types)
+
+        radius = np.broadcast_to(np.asarray(radius, dtype=np.float64), np.shape(x))
+        fields, arrays = self.share_index(index)
+        counts_spec, counts = self.block("counts", (len(x), n_types), np.int64)
+        counts[...] = 0
+        self.run("count", chunks, fields, arrays, self.share("x", np.asarray(x, dtype=np.float64)),
+                 self.share("y", np.asarray(y, dtype=np.float64)), self.share("radius", radius), counts_spec)
+        return counts.copy()
+
+    def share_index(self, index):
+        fields = {name: getattr(index, name) for name in INDEX_FIELDS}
+        return fields, {name: self.share("index_" + name, getattr(index, name)) for name in INDEX_ARRAYS}
+
+    def update_counts(self, index, x, y, types, radius, sign, neighbour_counts):
+        chunks = worker_chunks(len(x), self.n_workers)
+        if len(chunks) < 2:
+            counts = np.zeros((len(x), 2), dtype=np.int64)
+            update_chunk(index, x, y, types, radius, sign, counts, neighbour_counts, slice(None))
+            return counts
+
+        fields, arrays = self.share_index(index)
+        counts_spec, counts = self.block("counts", (len(x), 2), np.int64)
+        counts[...] = 0
+        deltas_spec, deltas = self.block("deltas", (len(chunks),) + neighbour_counts.shape, np.int64)
+        deltas[...] = 0
+        self.run("update", list(enumerate(chunks)), fields, arrays, self.share("x", np.asarray(x, dtype=np.float64)),
+                 self.share("y", np.asarray(y, dtype=np.float64)), self.share("types", np.asarray(types)),
+                 np.asarray(radius, dtype=np.float64), sign, counts_spec, deltas_spec)
+        neighbour_counts += deltas.sum(axis=0)
+        return counts.copy()
+
+    def rates(self, model, cells, counts, g):
+        chunks = worker_chunks(len(cells), self.n_workers)
+        if len(chunks) < 2:
+            return birth_probabilities(model, cells, counts), death_probabilities(cells, counts, g)
+
+        birth_spec, prob_birth = self.block("prob_birth", (len(cells),), np.float64)
+        death_spec, prob_death = self.block("prob_death", (len(cells),), np.float64)
+        self.run("rates", chunks, rate_parameters(model), self.share("cells", cells),
+                 self.share("neighbour_counts", counts), g, birth_spec, death_spec)
+        return prob_birth.copy(), prob_death.copy()
+
+    def close(self):
+        for connection in self.connections:
+            connection.send(("close",))
+        for worker in self.workers:
+            worker.join()
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.connections, self.workers, self.blocks = [], [], {}
+
+
+WORKER_BACKENDS = {"processes": ChunkProcesses, "threads": ChunkThreads}